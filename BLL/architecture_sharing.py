@@ -0,0 +1,15 @@
+import hashlib
+from typing import Tuple
+
+from BLL.caching import LRUCache
+from configs import LOADED_ARCHITECTURES_CACHE_SIZE
+
+
+def loaded_architecture(data: str) -> Tuple[bytes, str]:
+    # the stored JSON as the response body and its ETag
+    body = data.encode()
+    return body, '"{}"'.format(hashlib.sha256(body).hexdigest())
+
+
+# architecture id -> (stored JSON bytes, ETag); shared architectures never change, entries never get stale
+loaded_architectures_cache = LRUCache(LOADED_ARCHITECTURES_CACHE_SIZE)
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable
+
+
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def put(self, key: Hashable, value):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable):
+        return key in self._data
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            size=len(self._data),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+
+class TTLCache(LRUCache):
+    """
+    `LRUCache` whose entries expire `ttl` seconds after being put, or earlier at a given `time.monotonic()` moment.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize)
+        self.ttl = ttl
+        self.expirations = 0
+
+    def get(self, key: Hashable, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            with self._lock:
+                # might have been replaced in the meantime
+                if self._data.get(key) is entry:
+                    del self._data[key]
+                self.hits -= 1
+                self.misses += 1
+                self.expirations += 1
+            return default
+
+        return value
+
+    def put(self, key: Hashable, value, expires_at: float = None):
+        max_expires_at = time.monotonic() + self.ttl
+        expires_at = max_expires_at if expires_at is None else min(expires_at, max_expires_at)
+
+        super().put(key, (expires_at, value))
+
+    def stats(self) -> Dict[str, int]:
+        return dict(super().stats(), ttl=self.ttl, expirations=self.expirations)
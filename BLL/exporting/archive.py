@@ -0,0 +1,47 @@
+import zipfile
+from typing import Iterable, Iterator, List, Tuple
+
+
+class _BytesChunks:
+    """
+    Write-only file for `zipfile`: it keeps what was written until taken, nothing is seeked back.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+
+        return data
+
+
+def iter_zip(files: Iterable[Tuple[str, Iterable[str]]], compression: int = zipfile.ZIP_DEFLATED) -> Iterator[bytes]:
+    """
+    Zip archive of `files` (name and chunks of text of every file), yielded in chunks while the files are being
+    written - neither the files nor the archive are kept in memory as a whole.
+    """
+    buffer = _BytesChunks()
+    with zipfile.ZipFile(buffer, 'w', compression) as archive:
+        for name, chunks in files:
+            with archive.open(name, 'w') as f:
+                for chunk in chunks:
+                    f.write(chunk.encode())
+                    data = buffer.take()
+                    if data:
+                        yield data
+
+            data = buffer.take()
+            if data:
+                yield data
+
+    # the central directory
+    yield buffer.take()
@@ -0,0 +1,181 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional
+
+from configs import STREAM_EXPORT_THREADS, STREAM_EXPORT_STALL_TIMEOUT
+
+
+class CodeWriter:
+    """
+    Collects code fragments and joins them only once instead of concatenating the code on every write.
+    With a `sink` (anything having `write(str)`: a file, `io.StringIO`, `QueueSink`, ...) fragments are
+    flushed to it in chunks of about `chunk_size` characters and are not kept in memory afterwards.
+    """
+
+    def __init__(self, sink=None, chunk_size: int = 64 * 1024):
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self._fragments: List[str] = []
+        self._size = 0
+
+    def write(self, code: str):
+        self._fragments.append(code)
+        self._size += len(code)
+
+        if self.sink is not None and self._size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.sink is None or not self._fragments:
+            return
+
+        self.sink.write("".join(self._fragments))
+        self.clear()
+
+    def getvalue(self) -> str:
+        if len(self._fragments) > 1:
+            self._fragments = ["".join(self._fragments)]
+
+        return self._fragments[0] if self._fragments else ""
+
+    def clear(self):
+        self._fragments = []
+        self._size = 0
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class StreamProducersFull(Exception):
+    pass
+
+
+class QueueSink:
+    """
+    Passes written chunks to a consumer in another thread, blocking the writer while the bounded queue is full.
+    A writer blocked for longer than `stall_timeout` (the consumer stopped taking chunks) gets cancelled.
+    """
+    _DONE = object()
+
+    def __init__(self, max_chunks: int = 16, stall_timeout: float = None):
+        self._chunks = queue.Queue(maxsize=max_chunks)
+        self._cancelled = threading.Event()
+        self.stall_timeout = stall_timeout
+
+    def write(self, chunk: str):
+        self._put(chunk)
+
+    def close(self, error: Optional[BaseException] = None):
+        self._put(error if error is not None else self._DONE)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _put(self, item):
+        deadline = None if self.stall_timeout is None else time.monotonic() + self.stall_timeout
+        while True:
+            if self._cancelled.is_set():
+                raise ExportCancelled()
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if deadline is not None and time.monotonic() > deadline:
+                    self.cancel()
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            while True:
+                try:
+                    item = self._chunks.get(timeout=0.1)
+                except queue.Empty:
+                    # the writer gave up on a stalled consumer, what is left of the code is never coming
+                    if self._cancelled.is_set():
+                        raise ExportCancelled()
+                    continue
+
+                if item is self._DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+
+                yield item
+        finally:
+            # the consumer is gone (e.g. the client has disconnected) - the writer should stop too
+            self.cancel()
+
+
+class StreamProducers:
+    """
+    Bounded thread pool for the writers of streamed exports. Every running writer also keeps a consumer thread
+    of the server busy, so writers over `size` are rejected instead of queued.
+    """
+
+    def __init__(self, size: int, stall_timeout: float):
+        self.size = size
+        self.stall_timeout = stall_timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._running = 0
+        self.submitted = 0
+        self.rejected = 0
+
+    def submit(self, fn: Callable) -> Future:
+        with self._lock:
+            if self._running >= self.size:
+                self.rejected += 1
+                raise StreamProducersFull()
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.size, thread_name_prefix='stream-producer')
+
+            self._running += 1
+            self.submitted += 1
+
+        future = self._executor.submit(fn)
+        future.add_done_callback(self._producer_done)
+
+        return future
+
+    def _producer_done(self, future: Future):
+        with self._lock:
+            self._running -= 1
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                size=self.size,
+                running=self._running,
+                submitted=self.submitted,
+                rejected=self.rejected,
+            )
+
+
+stream_producers = StreamProducers(STREAM_EXPORT_THREADS, STREAM_EXPORT_STALL_TIMEOUT)
+
+
+def iter_chunks(write_code: Callable[[QueueSink], None], max_chunks: int = 16,
+                producers: StreamProducers = stream_producers) -> Iterator[str]:
+    """
+    Runs `write_code(sink)` in a thread of `producers` and yields chunks of code as soon as they are written
+    to `sink`. Raises `StreamProducersFull` right away when all their threads are busy.
+    """
+    sink = QueueSink(max_chunks, producers.stall_timeout)
+
+    def produce():
+        try:
+            write_code(sink)
+        except ExportCancelled:
+            return
+        except Exception as e:
+            sink.close(e)
+            return
+
+        sink.close()
+
+    producers.submit(produce)
+
+    return iter(sink)
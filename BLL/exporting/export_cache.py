@@ -0,0 +1,43 @@
+import hashlib
+import json
+from typing import List
+
+from BLL.caching import LRUCache
+from configs import EXPORT_CACHE_SIZE
+from models import ArchitectureDataModel, LayerData
+
+
+def architecture_hash(model: ArchitectureDataModel) -> str:
+    """
+    Hash of everything the generated code depends on - `id` and `date_created` are left out.
+    """
+    return layers_hash(model.name, model.layers)
+
+
+def layers_hash(name: str, layers: List[LayerData]) -> str:
+    input_names = set()
+    for l in layers:
+        input_names.update(l.inputs)
+
+    canonical = dict(
+        name=name,
+        layers=[[l.name, l.type.value, l.inputs, l.params] for l in sorted(layers, key=lambda x: x.name)],
+        # order of layers in the request only matters for the order of the output layers (the model gets linked
+        # starting from them), so it is kept for them only
+        outputs=[l.name for l in layers if l.name not in input_names],
+    )
+    # params keys are not sorted - keyword arguments are generated in the same order
+    canonical_str = json.dumps(canonical, separators=(',', ':'), ensure_ascii=False)
+
+    return hashlib.sha256(canonical_str.encode()).hexdigest()
+
+
+def export_cache_key(arch_hash: str, framework: str, line_break: str, indent: str, layers_schemas_version: int,
+                     **kwargs) -> str:
+    # layers schemas version is a part of the key since a cached model was validated against these schemas only
+    options = [framework, line_break, indent, layers_schemas_version, sorted(kwargs.items())]
+
+    return arch_hash + ":" + json.dumps(options, separators=(',', ':'))
+
+
+export_cache = LRUCache(EXPORT_CACHE_SIZE)
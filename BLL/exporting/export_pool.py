@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable
+
+from configs import EXPORT_POOL_SIZE, EXPORT_POOL_QUEUE_DEPTH, EXPORT_POOL_TIMEOUT, EXPORT_POOL_MIN_LAYERS
+
+
+class ExportPoolFull(Exception):
+    pass
+
+
+class ExportPool:
+    """
+    Bounded process pool for the CPU-bound part of exporting, so a large model doesn't block the event loop.
+    Jobs (functions and their arguments) and results have to be picklable.
+    Models smaller than `min_layers` are exported inline - for them the IPC costs more than it saves.
+    """
+
+    def __init__(self, size: int, queue_depth: int, timeout: float, min_layers: int):
+        self.size = size
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.min_layers = min_layers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def should_offload(self, num_layers: int) -> bool:
+        return self.size > 0 and num_layers >= self.min_layers
+
+    def submit(self, fn: Callable, *args) -> Future:
+        with self._lock:
+            if self._pending >= self.size + self.queue_depth:
+                self.rejected += 1
+                raise ExportPoolFull()
+
+            # created on the first use, i.e. in the server worker process and not in the one that imported the app
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.size)
+
+            self._pending += 1
+            self.submitted += 1
+
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._job_done)
+
+        return future
+
+    def run(self, fn: Callable, *args):
+        # the job keeps its process busy after a timeout - it can't be interrupted, only its result gets dropped
+        future = self.submit(fn, *args)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            self._timed_out()
+            raise
+
+    async def run_async(self, fn: Callable, *args):
+        future = asyncio.wrap_future(self.submit(fn, *args))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._timed_out()
+            raise
+
+    def _job_done(self, future: Future):
+        with self._lock:
+            self._pending -= 1
+
+    def _timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                size=self.size,
+                queue_depth=self.queue_depth,
+                min_layers=self.min_layers,
+                pending=self._pending,
+                submitted=self.submitted,
+                rejected=self.rejected,
+                timeouts=self.timeouts,
+            )
+
+
+export_pool = ExportPool(EXPORT_POOL_SIZE, EXPORT_POOL_QUEUE_DEPTH, EXPORT_POOL_TIMEOUT, EXPORT_POOL_MIN_LAYERS)
@@ -1,13 +1,16 @@
 from abc import ABC, abstractmethod
 
+from .graph_analysis import GraphAnalysis
 from .python_code_generator import PythonCodeGenerator
 from models import NetworkModel
 
 
 class FrameworkCodeGenerator(ABC):
-    def __init__(self, model: NetworkModel, cg: PythonCodeGenerator):
+    def __init__(self, model: NetworkModel, cg: PythonCodeGenerator, analysis: GraphAnalysis = None):
+        # generators tried one after another for the same export share the analysis
         self.model = model
         self.cg = cg
+        self.analysis = analysis if analysis is not None else GraphAnalysis(model)
 
     @abstractmethod
     def generate_code(self) -> str:
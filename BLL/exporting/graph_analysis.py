@@ -0,0 +1,89 @@
+from array import array
+from collections import deque
+from typing import Dict, List
+
+from models import NetworkModel, LayerNode, LayerTypes
+
+
+def has_regularizer(layer: LayerNode) -> bool:
+    return any(str(k).endswith('regularizer') for k in layer.params.keys())
+
+
+class GraphAnalysis:
+    """
+    Everything the code generators need to know about the linked model, computed in one pass over its layers
+    and shared by all generators of one export (the topological order is computed on the first use).
+    """
+
+    def __init__(self, model: NetworkModel):
+        self.model = model
+        num_layers = len(model)
+        in_offsets = model.inputs_offsets
+        out_offsets = model.outputs_offsets
+        self.in_degrees = array('i', (in_offsets[i + 1] - in_offsets[i] for i in range(num_layers)))
+        self.out_degrees = array('i', (out_offsets[i + 1] - out_offsets[i] for i in range(num_layers)))
+
+        # ids, in the order of the layers
+        self.input_layers: List[int] = []
+        self.first_layers: List[int] = []
+        self.output_layers: List[int] = []
+        # type -> number of layers, in the order of the first appearance
+        self.layer_types: Dict[str, int] = {}
+        self.num_regularized_layers = 0
+        self.is_sequential = True
+
+        for l in model.layers:
+            in_degree = self.in_degrees[l.id]
+            out_degree = self.out_degrees[l.id]
+            if l.type == LayerTypes.Input:
+                self.input_layers.append(l.id)
+            if in_degree == 0:
+                self.first_layers.append(l.id)
+            if out_degree == 0:
+                self.output_layers.append(l.id)
+            if in_degree > 1 or out_degree > 1:
+                self.is_sequential = False
+
+            self.layer_types[l.type.value] = self.layer_types.get(l.type.value, 0) + 1
+            if has_regularizer(l):
+                self.num_regularized_layers += 1
+
+        self._topological_order: List[List[int]] = None
+
+    def topological_order(self) -> List[List[int]]:
+        """
+        Kahn's algorithm starting from every input layer in turn (from every first layer if there are no Input
+        layers), layers that got all their inputs are visited depth-first. Returns ids of the layers split into
+        groups, one per starting layer.
+        """
+        if self._topological_order is not None:
+            return self._topological_order
+
+        model = self.model
+        from_inputs = bool(self.input_layers)
+        inputs_left = array('i', self.in_degrees)
+        groups = []
+        for start in self.input_layers if from_inputs else self.first_layers:
+            group = [start]
+            layers_to_visit = deque()
+            # outputs of an input layer are visited in their order, outputs of other layers - the last one first
+            visit = layers_to_visit.append if from_inputs else layers_to_visit.appendleft
+            l = start
+            while True:
+                for output in model.outputs(l):
+                    inputs_left[output] -= 1
+                    if inputs_left[output] == 0:
+                        visit(output)
+
+                if not layers_to_visit:
+                    break
+
+                visit = layers_to_visit.appendleft
+                l = layers_to_visit.popleft()
+                group.append(l)
+
+            groups.append(group)
+
+        self._topological_order = groups
+
+        return groups
@@ -0,0 +1,102 @@
+"""
+Architectures exported recently, kept by their hash so that the next version of one can be exported
+from a patch (list of layer operations) instead of the whole architecture.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from BLL.caching import LRUCache
+from configs import ARCHITECTURE_GRAPHS_CACHE_SIZE
+from models import LayerData, LayerNode, LayerPatchOperation, NetworkModel, PatchOperations
+
+
+class ArchitectureGraph:
+    __slots__ = ('name', 'layers', 'schemas_version', 'net_model', 'rendered_calls')
+
+    def __init__(self, name: str, layers: List[LayerData], schemas_version: int, net_model: NetworkModel = None,
+                 rendered_calls: Dict[str, Tuple[dict, str, str]] = None):
+        self.name = name
+        # in the request order, it decides the order of the output layers
+        self.layers = layers
+        # the layers were validated against this layers schemas version
+        self.schemas_version = schemas_version
+        # linked layers and code of the layers constructor calls, if the architecture was exported in this process
+        self.net_model = net_model
+        self.rendered_calls = rendered_calls
+
+
+def apply_patch(graph: ArchitectureGraph, operations: List[LayerPatchOperation], name: str = None) \
+        -> Tuple[str, List[LayerData], List[LayerData], bool]:
+    """
+    Returns the name and layers of the patched architecture, the layers added or modified by the patch
+    and whether the patch changes the graph structure (layers added, removed, renamed or their inputs changed).
+    Modified layers keep their positions, added ones are appended.
+    """
+    layers: List[Optional[LayerData]] = list(graph.layers)
+    positions = {l.name: i for i, l in enumerate(layers)}
+    touched: List[LayerData] = []
+    structural = False
+
+    for operation in operations:
+        if operation.op == PatchOperations.add:
+            layer = operation.layer
+            if layer is None:
+                raise ValueError("`layer` is required to add a layer")
+            if layer.name in positions:
+                raise ValueError(f'layer "{layer.name}" already exists')
+
+            positions[layer.name] = len(layers)
+            layers.append(layer)
+            touched.append(layer)
+            structural = True
+            continue
+
+        position = positions.get(operation.name)
+        if position is None:
+            raise ValueError(f'unknown layer "{operation.name}"')
+
+        if operation.op == PatchOperations.remove:
+            del positions[operation.name]
+            layers[position] = None
+            structural = True
+            continue
+
+        layer = operation.layer
+        if layer is None:
+            raise ValueError("`layer` is required to modify a layer")
+
+        if layer.name != operation.name:
+            if layer.name in positions:
+                raise ValueError(f'layer "{layer.name}" already exists')
+            del positions[operation.name]
+            positions[layer.name] = position
+            structural = True
+
+        if layer.inputs != layers[position].inputs:
+            structural = True
+
+        layers[position] = layer
+        touched.append(layer)
+
+    patched_layers = [l for l in layers if l is not None]
+    # a layer may have been added or modified and then removed or modified again
+    touched = [l for l in touched if l.name in positions and layers[positions[l.name]] is l]
+
+    return name or graph.name, patched_layers, touched, structural
+
+
+def patched_net_model(graph: ArchitectureGraph, name: str, touched: List[LayerData]) -> NetworkModel:
+    """
+    Linked patched architecture, for patches that don't change the structure only: the adjacency arrays of the base
+    are reused, the nodes of the modified layers are replaced.
+    """
+    base = graph.net_model
+    layers = list(base.layers)
+    for l in touched:
+        node = layers[base.ids[l.name]]
+        layers[node.id] = LayerNode(node.id, l.name, l.type, l.params)
+
+    return NetworkModel(layers, base.inputs_offsets, base.inputs_ids, base.outputs_offsets, base.outputs_ids,
+                        name=name)
+
+
+architecture_graphs = LRUCache(ARCHITECTURE_GRAPHS_CACHE_SIZE)
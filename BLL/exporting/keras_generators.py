@@ -1,31 +1,68 @@
-from abc import ABC
-from collections import deque, defaultdict
-from typing import Dict
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Dict, List, Tuple
 
 from .framework_code_generator import FrameworkCodeGenerator
+from .graph_analysis import GraphAnalysis, has_regularizer
 from .python_code_generator import PythonCodeGenerator
-from models import NetworkModel, FrameworkError, LayerTypes, Layer
+from models import NetworkModel, FrameworkError, LayerTypes, LayerNode
 
 
 class KerasGenerator(FrameworkCodeGenerator, ABC):
+    def __init__(self, model: NetworkModel, cg: PythonCodeGenerator,
+                 rendered_calls: Dict[str, Tuple[dict, str, str]] = None, analysis: GraphAnalysis = None):
+        """
+        `rendered_calls` (layer name -> params, type, code) keeps the code of layer constructor calls between exports
+        of versions of the same architecture: only layers whose params object or type differ are rendered again.
+        """
+        super().__init__(model, cg, analysis)
+        self.rendered_calls = rendered_calls
+
     def _parse_regularizer(self, regularizer_params: dict):
         return self.cg.call('l1_l2', l1=regularizer_params.get('l1', 0.0), l2=regularizer_params.get('l2', 0.0))
 
+    def _layer_call(self, layer: LayerNode, params: dict) -> str:
+        if self.rendered_calls is not None:
+            rendered = self.rendered_calls.get(layer.name)
+            if rendered is not None and rendered[0] is params and rendered[1] == layer.type:
+                return rendered[2]
+
+        cg = self.cg
+        call_params = params.copy()
+        for k, v in call_params.items():
+            if str(k).endswith('regularizer'):
+                call_params[k] = self._parse_regularizer(v)
+            else:
+                call_params[k] = cg.wrap_literal(call_params[k])
+
+        call_params['name'] = cg.wrap_literal(layer.name)
+        code = cg.call(layer.type, **call_params)
+
+        if self.rendered_calls is not None:
+            # the params object is kept too, so that its id can't be reused by another one
+            self.rendered_calls[layer.name] = (params, layer.type, code)
+
+        return code
+
+    @abstractmethod
+    def _exported_layers_types(self) -> List[str]:
+        """
+        Types of the layers in the generated code, in order of the first appearance.
+        """
+        pass
+
+    @abstractmethod
+    def _uses_regularizers(self) -> bool:
+        pass
+
     def _generate_imports(self) -> str:
         s = "from keras.layers import "
-        layers_types = set([l.type.value for l in self.model.layers])
-        s += self.cg.par(self.cg.sequence(layers_types))
+        # in order of the first appearance, so that the generated code is the same every time
+        s += self.cg.par(self.cg.sequence(self._exported_layers_types()))
         s += self.cg.line_break()
 
-        for l in self.model.layers:
-            for k in l.params.keys():
-                if str(k).endswith('regularizer'):
-                    s += "from keras.regularizers import l1_l2" + self.cg.line_break()
-                    break
-            # breaking out of inner and outer loops
-            else:
-                continue
-            break
+        if self._uses_regularizers():
+            s += "from keras.regularizers import l1_l2" + self.cg.line_break()
 
         s += self.cg.line_break()
 
@@ -33,29 +70,45 @@ class KerasGenerator(FrameworkCodeGenerator, ABC):
 
 
 class KerasSequentialGenerator(KerasGenerator):
-    def __init__(self, model: NetworkModel, cg: PythonCodeGenerator):
-        if not self._is_sequential(model):
+    def __init__(self, model: NetworkModel, cg: PythonCodeGenerator,
+                 rendered_calls: Dict[str, Tuple[dict, str, str]] = None, analysis: GraphAnalysis = None):
+        super().__init__(model, cg, rendered_calls, analysis)
+        if not self.analysis.is_sequential:
             raise FrameworkError("Model given is NOT sequential.")
 
-        seq_model = self._to_sequential_format(model)
-        super().__init__(seq_model, cg)
+        self.first_layer_id, self.first_layer_params = self._to_sequential_format(model)
 
     @staticmethod
     def _to_sequential_format(model: NetworkModel):
+        # instead of a separate Input layer, Sequential API expects `input_shape` of the first layer
+        # (the model itself is left intact)
         if model.layers[0].type == LayerTypes.Input:
             input_shape = model.layers[0].params['shape']
-            model.layers[1].params['input_shape'] = input_shape
-            model.layers.pop(0)
+            first_layer_params = model.layers[1].params.copy()
+            first_layer_params['input_shape'] = input_shape
 
-        return model
+            return 1, first_layer_params
 
-    @staticmethod
-    def _is_sequential(model: NetworkModel):
-        for l in model.layers:
-            if len(l.outputs) > 1 or len(l.inputs) > 1:
-                return False
+        return 0, model.layers[0].params
+
+    def _exported_layers_types(self) -> List[str]:
+        layer_types = self.analysis.layer_types
+        if self.first_layer_id == 0:
+            return list(layer_types)
+
+        # the Input layer is not exported
+        input_type = self.model.layers[0].type.value
+        if layer_types[input_type] == 1:
+            return [t for t in layer_types if t != input_type]
+
+        return list(dict.fromkeys(l.type.value for l in self.model.layers[self.first_layer_id:]))
+
+    def _uses_regularizers(self) -> bool:
+        num_regularized_layers = self.analysis.num_regularized_layers
+        if self.first_layer_id and has_regularizer(self.model.layers[0]):
+            num_regularized_layers -= 1
 
-        return True
+        return num_regularized_layers > 0
 
     def _generate_imports(self) -> str:
         s = "from keras.models import Sequential" + self.cg.line_break()
@@ -70,21 +123,14 @@ class KerasSequentialGenerator(KerasGenerator):
 
             cg.add_line(f"model = {cg.call('Sequential', name=name)}")
 
-            l = self.model.layers[0]
+            l = self.model.layers[self.first_layer_id]
+            params = self.first_layer_params
             while True:
-                params = l.params.copy()
-                for k, v in params.items():
-                    if str(k).endswith('regularizer'):
-                        params[k] = self._parse_regularizer(v)
-                    else:
-                        params[k] = cg.wrap_literal(params[k])
-
-                params['name'] = cg.wrap_literal(l.name)
-                layer_code = cg.call(l.type.value, **params)
-                cg.add_line("model.add" + cg.par(layer_code))
-
-                if l.outputs:
-                    l = l.outputs[0]
+                cg.add_line("model.add" + cg.par(self._layer_call(l, params)))
+
+                if self.model.out_degree(l.id):
+                    l = self.model.layers[self.model.outputs(l.id)[0]]
+                    params = l.params
                 else:
                     break
 
@@ -96,31 +142,50 @@ class KerasSequentialGenerator(KerasGenerator):
 
 
 class KerasFunctionalGenerator(KerasGenerator):
-    def __init__(self, model: NetworkModel, cg: PythonCodeGenerator):
-        func_model = self._to_functional_format(model)
-        super().__init__(func_model, cg)
-
-    @staticmethod
-    def _to_functional_format(model: NetworkModel):
-        input_layers = [l for l in model.layers if l.type == LayerTypes.Input]
-
-        if not any(input_layers):
-            first_layers = [l for l in model.layers if len(l.inputs) == 0]
-            for l in first_layers:
-                inp = Layer(
+    def __init__(self, model: NetworkModel, cg: PythonCodeGenerator,
+                 rendered_calls: Dict[str, Tuple[dict, str, str]] = None, analysis: GraphAnalysis = None):
+        super().__init__(model, cg, rendered_calls, analysis)
+        self.layers: List[LayerNode] = list(model.layers)
+        # links and params differing from those in the model, the model itself is left intact
+        self._inputs: Dict[int, List[int]] = {}
+        self._params: Dict[int, dict] = {}
+        # Input layers created for the first layers of a model without them, by the first layer id
+        self._added_inputs: Dict[int, int] = {}
+        self._to_functional_format(model)
+
+    def _to_functional_format(self, model: NetworkModel):
+        if not self.analysis.input_layers:
+            for l in map(model.layers.__getitem__, self.analysis.first_layers):
+                inp = LayerNode(
+                    id=len(self.layers),
                     name=l.name + '_input',
-                    inputs=[],
-                    outputs=[l],
                     type=LayerTypes.Input,
                     params=dict(
                         shape=l.params['input_shape']
                     )
                 )
-                l.inputs.append(inp)
-                del l.params['input_shape']
-                model.layers.append(inp)
+                self.layers.append(inp)
+                self._added_inputs[l.id] = inp.id
+                # the added layers are not in the model
+                self._inputs[inp.id] = []
+                self._inputs[l.id] = [inp.id]
+                self._params[l.id] = l.params.copy()
+                del self._params[l.id]['input_shape']
+
+    def _layer_inputs(self, layer_id: int):
+        if layer_id in self._inputs:
+            return self._inputs[layer_id]
 
-        return model
+        return self.model.inputs(layer_id)
+
+    def _exported_layers_types(self) -> List[str]:
+        if self._added_inputs:
+            return list(self.analysis.layer_types) + [LayerTypes.Input.value]
+
+        return list(self.analysis.layer_types)
+
+    def _uses_regularizers(self) -> bool:
+        return self.analysis.num_regularized_layers > 0
 
     def _generate_imports(self) -> str:
         s = "from keras.models import Model" + self.cg.line_break()
@@ -139,63 +204,49 @@ class KerasFunctionalGenerator(KerasGenerator):
 
         return name
 
-    def _generate_layer_creation_code(self, layer: Layer, cg: PythonCodeGenerator, names_counter: Dict[str, int]):
-        params = layer.params.copy()
-        for k, v in params.items():
-            if str(k).endswith('regularizer'):
-                params[k] = self._parse_regularizer(v)
-            else:
-                params[k] = cg.wrap_literal(params[k])
-
-        params['name'] = cg.wrap_literal(layer.name)
-
+    def _generate_layer_creation_code(self, layer: LayerNode, cg: PythonCodeGenerator, names_counter: Dict[str, int]):
         layer_var_name = self._generate_variable_name(layer.type, names_counter)
         # existing_tensor_variables[l.name] = layer_var_name
         layer_line = "{} = {}".format(
             layer_var_name,
-            cg.call(layer.type, **params)
+            self._layer_call(layer, self._params.get(layer.id, layer.params))
         )
 
         return layer_line, layer_var_name
 
+    def _topological_order(self) -> List[List[int]]:
+        groups = self.analysis.topological_order()
+        if not self._added_inputs:
+            return groups
+
+        # the added Input layer starts the group of its first layer
+        return [[self._added_inputs[group[0]]] + group for group in groups]
+
     def generate_code(self) -> str:
         with self.cg as cg:
             cg.add_line(self._generate_imports())
             name = cg.wrap_literal(self.model.name)
 
-            input_layers = [l for l in self.model.layers if l.type == LayerTypes.Input]
-            output_layers = [l for l in self.model.layers if not l.outputs]
+            if self._added_inputs:
+                input_layers = list(self._added_inputs.values())
+            else:
+                input_layers = self.analysis.input_layers
+            output_layers = self.analysis.output_layers
 
             variable_names_counter = defaultdict(lambda: 0)  # only for generating variable names
             existing_tensor_variables = dict()  # for accessing tensor variables created earlier
-            visited_layer_names = set()
-
-            # iterative depth-first traverse of the model graph
-            starting_layers = deque(input_layers)
-            while len(starting_layers) != 0:
-                current_start_layer = starting_layers.popleft()
-                inp_layer_line, inp_layer_var_name = self._generate_layer_creation_code(current_start_layer, cg,
-                                                                                        variable_names_counter)
-                cg.add_line(inp_layer_line)
-                existing_tensor_variables[current_start_layer.name] = inp_layer_var_name
-                visited_layer_names.add(current_start_layer.name)
-                layers_to_visit = deque(current_start_layer.outputs)
-
-                while len(layers_to_visit) != 0:
-                    current_layer = layers_to_visit.popleft()
-
-                    if not all(i.name in visited_layer_names for i in current_layer.inputs):
-                        # skip this layer for now
-                        continue
-                    else:
-                        visited_layer_names.add(current_layer.name)
+
+            for group in self._topological_order():
+                for l in group:
+                    current_layer = self.layers[l]
+                    current_layer_inputs = self._layer_inputs(l)
 
                     layer_line, layer_var_name = self._generate_layer_creation_code(current_layer, cg,
                                                                                     variable_names_counter)
-                    existing_tensor_variables[current_layer.name] = layer_var_name
+                    existing_tensor_variables[l] = layer_var_name
 
-                    if current_layer.inputs:
-                        layer_inputs_var_names = [existing_tensor_variables[i.name] for i in current_layer.inputs]
+                    if len(current_layer_inputs):
+                        layer_inputs_var_names = [existing_tensor_variables[i] for i in current_layer_inputs]
                         if len(layer_inputs_var_names) == 1:
                             layer_call_inputs_args = layer_inputs_var_names[0]
                         else:
@@ -203,14 +254,11 @@ class KerasFunctionalGenerator(KerasGenerator):
 
                         layer_line += cg.call('', layer_call_inputs_args)
 
-                    for output in current_layer.outputs:
-                        layers_to_visit.appendleft(output)
-
                     cg.add_line(layer_line)
                 cg.add_line()
 
-            model_inputs_args = [existing_tensor_variables[l.name] for l in input_layers]
-            model_outputs_args = [existing_tensor_variables[l.name] for l in output_layers]
+            model_inputs_args = [existing_tensor_variables[l] for l in input_layers]
+            model_outputs_args = [existing_tensor_variables[l] for l in output_layers]
 
             if len(model_inputs_args) == 1:
                 model_inputs_str = model_inputs_args[0]
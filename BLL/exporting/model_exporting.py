@@ -1,28 +1,54 @@
+from typing import Iterator
+
+from BLL.exporting.graph_analysis import GraphAnalysis
 from BLL.exporting.keras_generators import KerasSequentialGenerator, KerasFunctionalGenerator
+from BLL.exporting.shape_inference import estimate_model
+from BLL.stage_timing import stage
+from .code_writer import iter_chunks
 from .python_code_generator import PythonCodeGenerator
-from models import NetworkModel, FrameworkError
+from models import NetworkModel
 
 
-def export_model(model: NetworkModel, framework: str, line_break: str, indent: str, **kwargs):
+def export_model(model: NetworkModel, framework: str, line_break: str, indent: str, sink=None, **kwargs):
+    """
+    Returns the generated code, or writes it into `sink` (anything having `write(str)`) while generating.
+    With `estimate_header` the code starts with a comment with the model size estimate.
+    """
     exporter = exporters[framework]
-    cg = PythonCodeGenerator(indent_str=indent, line_break_str=line_break)
+    cg = PythonCodeGenerator(indent_str=indent, line_break_str=line_break, sink=sink)
+
+    header = ""
+    if kwargs.get('estimate_header'):
+        with stage('estimate'):
+            header = estimate_model(model).comment(line_break)
+        if sink is not None:
+            sink.write(header)
+            header = ""
 
     # by passing **kwargs key-word arguments of method will be automatically mapped to those in dict
-    return exporter(model, cg, **kwargs)
+    with stage('codegen'):
+        return header + exporter(model, cg, **kwargs)
+
+
+def iter_export_model(model: NetworkModel, framework: str, line_break: str, indent: str, **kwargs) -> Iterator[str]:
+    """
+    Generates the code in a separate thread, yielding its chunks as soon as they are ready.
+    """
+    return iter_chunks(lambda sink: export_model(model, framework, line_break, indent, sink=sink, **kwargs))
 
 
 def export_keras(model: NetworkModel, cg: PythonCodeGenerator, **kwargs):
     use_sequential = kwargs.get('keras_prefer_sequential', False)
+    rendered_calls = kwargs.get('rendered_calls')
+    # exports of one model for several targets share it
+    analysis = kwargs.get('analysis') or GraphAnalysis(model)
 
-    if use_sequential:
-        try:
-            gen = KerasSequentialGenerator(model, cg)
-            return gen.generate_code()
-        except FrameworkError:
-            # if the model is not Sequential, we will switch to Functional Api instead
-            pass
+    if use_sequential and analysis.is_sequential:
+        gen = KerasSequentialGenerator(model, cg, rendered_calls, analysis)
+        return gen.generate_code()
 
-    gen = KerasFunctionalGenerator(model, cg)
+    # if the model is not Sequential, we will switch to Functional Api instead
+    gen = KerasFunctionalGenerator(model, cg, rendered_calls, analysis)
 
     return gen.generate_code()
 
@@ -1,33 +1,98 @@
+import ast
+import json
+import math
+from functools import lru_cache
 from typing import Iterable
 
+from .code_writer import CodeWriter
+
+# floats are rendered every time: `0.0 == -0.0`, memoized they would both be rendered as the one seen first
+_MEMOIZED_SCALAR_TYPES = (bool, int, str, type(None))
+
+
+@lru_cache(maxsize=4096)
+def _is_python_literal(code: str) -> bool:
+    try:
+        # leading spaces and tabs are ignored the same way `eval` does it
+        ast.literal_eval(code.lstrip(' \t'))
+        return True
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return False
+
+
+def _quoted(code: str) -> str:
+    if '"' in code or '\\' in code or not code.isprintable():
+        return json.dumps(code, ensure_ascii=False)
+
+    return f'"{code}"'
+
+
+def _is_finite(value) -> bool:
+    # `str()` of NaN and infinity is not a valid python literal
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, (list, tuple)):
+        return all(map(_is_finite, value))
+    if isinstance(value, dict):
+        return all(map(_is_finite, value.values()))
+
+    return True
+
+
+def _render_literal(value) -> str:
+    if value is None or isinstance(value, (bool, int)):
+        return str(value)
+
+    if isinstance(value, str):
+        # strings that are valid python literals are kept as they are (e.g. "5", "(224, 224, 3)")
+        return value if _is_python_literal(value) else _quoted(value)
+
+    code = str(value)
+    if isinstance(value, (float, list, tuple, dict)):
+        return code if _is_finite(value) else _quoted(code)
+
+    return code if _is_python_literal(code) else _quoted(code)
+
+
+@lru_cache(maxsize=4096)
+def _render_hashable_literal(value, value_type, items_types) -> str:
+    # types are a part of the key: `1`, `1.0` and `True` (as well as `[1]` and `[True]`) are equal to each other
+    return _render_literal(value_type(value) if items_types is not None else value)
+
 
 class PythonCodeGenerator:
     """
-    Since approx. 2004 `+=` for strings is a little bit faster than `"".join` due to in-place resizing
+    Generated code goes to a `CodeWriter`: when a `sink` is given, code is written into it in chunks
+    while being generated, and `code` only returns what has not been flushed yet (so - nothing, once generated).
     """
 
-    def __init__(self, indent_str='\t', line_break_str='\n'):
+    def __init__(self, indent_str='\t', line_break_str='\n', sink=None, chunk_size: int = 64 * 1024):
         self.indent_str = indent_str
         self.line_break_str = line_break_str
-        self.__code = ""
+        self.__writer = CodeWriter(sink, chunk_size)
 
     @staticmethod
-    def wrap_literal(value: str):
-        try:
-            eval(str(value))
+    def wrap_literal(value) -> str:
+        """
+        Python source code of `value`, strings that are not python literals themselves get quoted.
+        Values with only non-float scalars inside (activations, shapes, etc.) are memoized.
+        """
+        value_type = type(value)
+        if value_type in _MEMOIZED_SCALAR_TYPES:
+            return _render_hashable_literal(value, value_type, None)
+
+        if value_type in (list, tuple) and all(type(v) in _MEMOIZED_SCALAR_TYPES for v in value):
+            return _render_hashable_literal(tuple(value), value_type, tuple(map(type, value)))
 
-            # we know that `value` is a valid python literal
-            return value
-        except (NameError, SyntaxError):
-            # adding quotes for possible string literals
-            return f'"{value}"'
+        return _render_literal(value)
 
     @property
     def code(self):
-        return self.__code
+        self.__writer.flush()
+        return self.__writer.getvalue()
 
     def add(self, code: str):
-        self.__code += code
+        self.__writer.write(code)
 
     def add_line(self, code: str = ''):
         self.add(code)
@@ -37,7 +102,7 @@ class PythonCodeGenerator:
         self.add(self.indent_block(code, indent_depth))
 
     def clear(self):
-        self.__code = ""
+        self.__writer.clear()
 
     def __enter__(self):
         self.clear()
@@ -53,12 +118,9 @@ class PythonCodeGenerator:
         return self.indent_str
 
     def indent_block(self, code: str, indent_depth: int = 1):
-        s = ""
-        for l in code.split('\n'):
-            s += self.indent() * indent_depth
-            s += l
+        indent = self.indent() * indent_depth
 
-        return s
+        return "".join(indent + l for l in code.split('\n'))
 
     @staticmethod
     def surrounded(code: str, left: str, right: str):
@@ -94,14 +156,11 @@ class PythonCodeGenerator:
         return s
 
     def call(self, callable_name: str, *args: str, **kwargs: str):
-        s = callable_name
         all_arguments = self.sequence(
             args,
             trailing_comma=False,
             trailing_space=False
         )
         kw_list = ["{}={}".format(k, v) for k, v in kwargs.items()]
-        all_arguments += self.sequence(kw_list)
-        s += self.par(all_arguments)
 
-        return s
+        return "".join((callable_name, "(", all_arguments, self.sequence(kw_list), ")"))
@@ -0,0 +1,330 @@
+"""
+Output shapes, parameters, FLOPs and activation memory of the layers of a linked model, following Keras
+(channels last, shapes without the batch dimension, FLOPs and memory per sample, float32 values).
+Every layer is visited once, in a topological order. Layers of unsupported types, with invalid params or depending
+on such layers are left out of the estimate and reported.
+"""
+import ast
+import re
+from array import array
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from models import NetworkModel, LayerNode
+
+BYTES_PER_VALUE = 4
+
+Shape = Tuple[Optional[int], ...]
+
+_CONV_TYPE = re.compile(r'^Conv([123])D$')
+_POOLING_TYPE = re.compile(r'^(?:Max|Average)Pool(?:ing)?([123])D$')
+_GLOBAL_POOLING_TYPE = re.compile(r'^Global(?:Max|Average)Pool(?:ing)?([123])D$')
+_UP_SAMPLING_TYPE = re.compile(r'^UpSampling([123])D$')
+_MERGE_TYPES = {'Add', 'Subtract', 'Multiply', 'Average', 'Maximum', 'Minimum'}
+# output shape is the input shape, values are only scaled or dropped
+_ELEMENTWISE_TYPES = {'Activation', 'ReLU', 'LeakyReLU', 'ELU', 'Softmax', 'ThresholdedReLU'}
+_NO_OP_TYPES = {'Dropout', 'SpatialDropout1D', 'SpatialDropout2D', 'SpatialDropout3D', 'GaussianNoise',
+                'GaussianDropout', 'AlphaDropout'}
+
+
+class NotEstimated(Exception):
+    pass
+
+
+class LayerEstimate(NamedTuple):
+    name: str
+    type: str
+    output_shape: Shape
+    params: int
+    # None when the shape has unknown (variable) dimensions
+    flops: Optional[int]
+    activation_bytes: Optional[int]
+
+
+class ModelEstimate:
+    def __init__(self, layers: List[LayerEstimate], not_estimated: Dict[str, str]):
+        # in a topological order
+        self.layers = layers
+        # layer name -> reason
+        self.not_estimated = not_estimated
+        self.params = sum(l.params for l in layers)
+        self.flops = sum(l.flops for l in layers if l.flops is not None)
+        self.activation_bytes = sum(l.activation_bytes for l in layers if l.activation_bytes is not None)
+        # totals are lower bounds otherwise
+        self.complete = not not_estimated and all(l.flops is not None for l in layers)
+
+    def to_dict(self, include_layers: bool = True) -> dict:
+        res = dict(
+            params=self.params,
+            params_bytes=self.params * BYTES_PER_VALUE,
+            flops=self.flops,
+            activation_bytes=self.activation_bytes,
+            complete=self.complete,
+            not_estimated=self.not_estimated,
+        )
+        if include_layers:
+            res['layers'] = [l._asdict() for l in self.layers]
+
+        return res
+
+    def comment(self, line_break: str) -> str:
+        lines = [
+            "# Estimated per sample, float32 values:",
+            "# parameters: {:,} ({})".format(self.params, format_bytes(self.params * BYTES_PER_VALUE)),
+            "# FLOPs: {:,}".format(self.flops),
+            "# activation memory: {}".format(format_bytes(self.activation_bytes)),
+        ]
+        if not self.complete:
+            lines.append("# (lower bounds: some layers have unknown dimensions or could not be estimated)")
+
+        return line_break.join(lines) + line_break * 2
+
+
+def format_bytes(num_bytes: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if num_bytes < 1024:
+            return "{:.1f} {}".format(num_bytes, unit) if unit != "B" else "{} B".format(num_bytes)
+        num_bytes /= 1024
+
+    return "{:.1f} TiB".format(num_bytes)
+
+
+def _value(params: dict, key: str, default=None):
+    value = params.get(key, default)
+    if isinstance(value, str):
+        # the same values are valid in the generated code, e.g. "(3, 3)"
+        try:
+            value = ast.literal_eval(value.lstrip(' \t'))
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            pass
+
+    return value
+
+
+def _int(params: dict, key: str, default=None) -> int:
+    value = _value(params, key, default)
+    if type(value) is not int or value < 1:
+        raise NotEstimated(f"`{key}` must be a positive integer")
+
+    return value
+
+
+def _ints(params: dict, key: str, rank: int, default=None) -> Tuple[int, ...]:
+    value = _value(params, key, default)
+    if type(value) is int:
+        value = (value,) * rank
+    if not isinstance(value, (list, tuple)) or len(value) != rank or \
+            not all(type(v) is int and v > 0 for v in value):
+        raise NotEstimated(f"`{key}` must be a positive integer or {rank} of them")
+
+    return tuple(value)
+
+
+def _shape(params: dict, key: str) -> Shape:
+    value = _value(params, key)
+    if type(value) is int:
+        value = (value,)
+    if not isinstance(value, (list, tuple)) or not all(v is None or (type(v) is int and v > 0) for v in value):
+        raise NotEstimated(f"`{key}` must be a list of positive integers or nulls")
+
+    return tuple(value)
+
+
+def _size(shape: Shape) -> Optional[int]:
+    if None in shape:
+        return None
+
+    return _product(shape)
+
+
+def _product(values) -> int:
+    res = 1
+    for v in values:
+        res *= v
+
+    return res
+
+
+def _windowed(dims: Shape, windows: Tuple[int, ...], strides: Tuple[int, ...], padding: str,
+              dilations: Tuple[int, ...] = None) -> Shape:
+    if padding not in ('valid', 'same', 'causal'):
+        raise NotEstimated(f"unknown padding {padding}")
+
+    out = []
+    for i, d in enumerate(dims):
+        if d is None:
+            out.append(None)
+        elif padding == 'valid':
+            window = (windows[i] - 1) * (dilations[i] if dilations else 1) + 1
+            out.append((d - window) // strides[i] + 1)
+        else:
+            out.append(-(-d // strides[i]))
+
+    if any(d is not None and d < 1 for d in out):
+        raise NotEstimated("the output would be empty, the input is too small")
+
+    return tuple(out)
+
+
+def _with_rank(shape: Shape, rank: int) -> Shape:
+    if len(shape) != rank:
+        raise NotEstimated(f"expects inputs with {rank} dimensions, got {len(shape)}")
+    if shape[-1] is None:
+        raise NotEstimated("the number of channels must be known")
+
+    return shape
+
+
+def estimate_layer(layer: LayerNode, input_shapes: List[Shape]) -> Tuple[Shape, int, Optional[int]]:
+    """
+    Returns the output shape, number of parameters and FLOPs of the layer.
+    """
+    layer_type = layer.type.value
+    params = layer.params
+    shape = input_shapes[0] if input_shapes else None
+
+    if layer_type == 'Input':
+        return _shape(params, 'shape'), 0, 0
+
+    if shape is None:
+        raise NotEstimated("the layer has no inputs")
+
+    if layer_type in _MERGE_TYPES:
+        if any(len(s) != len(shape) for s in input_shapes):
+            raise NotEstimated("inputs have different numbers of dimensions")
+        size = _size(shape)
+        return shape, 0, None if size is None else size * (len(input_shapes) - 1)
+
+    if len(input_shapes) > 1 and layer_type != 'Concatenate':
+        raise NotEstimated("the layer takes a single input")
+
+    if layer_type == 'Dense':
+        units = _int(params, 'units')
+        if not shape or shape[-1] is None:
+            raise NotEstimated("the last dimension of the input must be known")
+        size = _size(shape[:-1])
+        weights = shape[-1] * units
+        return shape[:-1] + (units,), weights + units * bool(_value(params, 'use_bias', True)), \
+            None if size is None else 2 * weights * size
+
+    if layer_type == 'Flatten':
+        return (_size(shape),), 0, 0
+
+    if layer_type == 'Concatenate':
+        axis = _value(params, 'axis', -1)
+        if type(axis) is not int or not -len(shape) <= axis < len(shape):
+            raise NotEstimated("`axis` must be a dimension of the inputs")
+        axis %= len(shape)
+        if any(len(s) != len(shape) for s in input_shapes):
+            raise NotEstimated("inputs have different numbers of dimensions")
+        dims = [s[axis] for s in input_shapes]
+        return shape[:axis] + (None if None in dims else sum(dims),) + shape[axis + 1:], 0, 0
+
+    if layer_type in _NO_OP_TYPES:
+        return shape, 0, 0
+
+    if layer_type in _ELEMENTWISE_TYPES:
+        return shape, 0, _size(shape)
+
+    if layer_type == 'BatchNormalization':
+        if shape[-1] is None:
+            raise NotEstimated("the number of channels must be known")
+        # gamma, beta, moving mean and variance; scale and shift at inference
+        size = _size(shape)
+        return shape, 4 * shape[-1], None if size is None else 2 * size
+
+    if layer_type == 'Reshape':
+        target = _value(params, 'target_shape')
+        if not isinstance(target, (list, tuple)) or not all(type(d) is int and (d > 0 or d == -1) for d in target) \
+                or list(target).count(-1) > 1:
+            raise NotEstimated("`target_shape` must be a list of positive integers and at most one -1")
+        size = _size(shape)
+        if -1 in target:
+            known = _product(d for d in target if d != -1)
+            if size is not None and size % known:
+                raise NotEstimated("`target_shape` doesn't match the input size")
+            missing = None if size is None else size // known
+            target = [missing if d == -1 else d for d in target]
+        elif size is not None and size != _product(target):
+            raise NotEstimated("`target_shape` doesn't match the input size")
+        return tuple(target), 0, 0
+
+    match = _CONV_TYPE.match(layer_type)
+    if match:
+        rank = int(match.group(1))
+        shape = _with_rank(shape, rank + 1)
+        filters = _int(params, 'filters')
+        kernel = _ints(params, 'kernel_size', rank)
+        out = _windowed(shape[:-1], kernel, _ints(params, 'strides', rank, 1), _value(params, 'padding', 'valid'),
+                        _ints(params, 'dilation_rate', rank, 1))
+        weights = _product(kernel) * shape[-1] * filters
+        size = _size(out)
+        return out + (filters,), weights + filters * bool(_value(params, 'use_bias', True)), \
+            None if size is None else 2 * weights * size
+
+    match = _POOLING_TYPE.match(layer_type)
+    if match:
+        rank = int(match.group(1))
+        shape = _with_rank(shape, rank + 1)
+        pool = _ints(params, 'pool_size', rank, 2)
+        strides = _value(params, 'strides')
+        out = _windowed(shape[:-1], pool, pool if strides is None else _ints(params, 'strides', rank),
+                        _value(params, 'padding', 'valid'))
+        size = _size(out)
+        return out + shape[-1:], 0, None if size is None else _product(pool) * size * shape[-1]
+
+    match = _GLOBAL_POOLING_TYPE.match(layer_type)
+    if match:
+        shape = _with_rank(shape, int(match.group(1)) + 1)
+        return shape[-1:], 0, _size(shape)
+
+    match = _UP_SAMPLING_TYPE.match(layer_type)
+    if match:
+        rank = int(match.group(1))
+        shape = _with_rank(shape, rank + 1)
+        factors = _ints(params, 'size', rank, 2)
+        return tuple(None if d is None else d * f for d, f in zip(shape, factors)) + shape[-1:], 0, 0
+
+    raise NotEstimated(f"layer type {layer_type} is not supported")
+
+
+def estimate_model(model: NetworkModel) -> ModelEstimate:
+    offsets = model.inputs_offsets
+    inputs_left = array('i', (offsets[i + 1] - offsets[i] for i in range(len(model))))
+    layers_to_visit = deque(i for i, n in enumerate(inputs_left) if n == 0)
+    shapes: List[Optional[Shape]] = [None] * len(model)
+    layers = []
+    not_estimated = {}
+
+    while layers_to_visit:
+        l = layers_to_visit.popleft()
+        layer = model.layers[l]
+        for output in model.outputs(l):
+            inputs_left[output] -= 1
+            if inputs_left[output] == 0:
+                layers_to_visit.append(output)
+
+        input_shapes = [shapes[i] for i in model.inputs(l)]
+        if not input_shapes and 'input_shape' in layer.params:
+            # first layers of a model without Input layers
+            try:
+                input_shapes = [_shape(layer.params, 'input_shape')]
+            except NotEstimated as e:
+                not_estimated[layer.name] = str(e)
+                continue
+        if any(s is None for s in input_shapes):
+            not_estimated[layer.name] = "depends on layers that could not be estimated"
+            continue
+
+        try:
+            shape, num_params, flops = estimate_layer(layer, input_shapes)
+        except NotEstimated as e:
+            not_estimated[layer.name] = str(e)
+            continue
+
+        shapes[l] = shape
+        size = _size(shape)
+        layers.append(LayerEstimate(layer.name, layer.type.value, shape, num_params, flops,
+                                    None if size is None else size * BYTES_PER_VALUE))
+
+    return ModelEstimate(layers, not_estimated)
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, NamedTuple
+
+from jsonschema.exceptions import SchemaError
+from sqlalchemy.orm import Session
+
+from BLL.validation import LayerValidatorsRegistry
+from DAL import layers_schemas_repository
+
+
+class LayersSchemasSnapshot(NamedTuple):
+    version: int
+    schemas: Dict[str, dict]
+    # pre-serialized `schemas`, served by `GET /admin/layers_schemas` as is
+    body: bytes
+    etag: str
+    validators: LayerValidatorsRegistry
+
+
+class LayersSchemasCache:
+    """
+    Per-worker cache of the layers schemas, keyed by the schemas version stored in the DB.
+    Checking that single value is all it takes to find out whether the schemas were changed by any worker.
+    """
+
+    def __init__(self, unknown_type_refresh_interval: float = 1.0):
+        self._snapshot: LayersSchemasSnapshot = None
+        self._lock = threading.Lock()
+        self._last_refresh = 0.0
+        self.unknown_type_refresh_interval = unknown_type_refresh_interval
+
+    def get(self, db: Session) -> LayersSchemasSnapshot:
+        version = layers_schemas_repository.get_layers_schemas_version(db)
+        self._last_refresh = time.monotonic()
+
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self._load(db, version)
+
+            return self._snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def is_unknown_layer_type(self, layer_type: str) -> bool:
+        """
+        Whether the type is surely unknown, by the loaded snapshot alone (it runs while parsing requests, no DB here).
+        A type missing from a snapshot not checked against the DB lately might have been added by another worker,
+        it is left to the schemas check of the endpoint, which gets the current snapshot anyway.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or layer_type in snapshot.schemas:
+            return False
+
+        return time.monotonic() - self._last_refresh < self.unknown_type_refresh_interval
+
+    def load_snapshot_file(self, path: str) -> bool:
+        """
+        Starts with the schemas saved by `write_snapshot_file`, no DB needed (they're still checked against
+        the DB version on the first `get`). Loaded before forking workers, it is shared by all of them.
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return False
+
+        try:
+            version_line, body = data.split(b"\n", 1)
+            snapshot = self._make_snapshot(int(version_line), body)
+            if not isinstance(snapshot.schemas, dict):
+                raise ValueError("layers schemas must be a JSON object")
+            # compiled before forking workers too, which also checks every schema
+            for layer_type in snapshot.schemas:
+                snapshot.validators.get_validator(layer_type)
+        except (ValueError, TypeError, SchemaError):
+            # a corrupt snapshot must not keep the app from starting, the schemas are loaded from the DB instead
+            logging.warning("Ignoring the invalid layers schemas snapshot %s", path, exc_info=True)
+            return False
+
+        self._snapshot = snapshot
+
+        return True
+
+    def write_snapshot_file(self, path: str, db: Session):
+        snapshot = self.get(db)
+        # written next to the target and moved over it so that nobody ever reads a half-written file
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(str(snapshot.version).encode() + b"\n" + snapshot.body)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def _load(cls, db: Session, version: int) -> LayersSchemasSnapshot:
+        # the version is read before the rows: at worst newer rows get cached under an older version
+        # and are reloaded on the next check, never the other way round
+        layer_schemas_strs = []
+        # concatenating JSON representations from db (they are already serialized strings)
+        for schema in layers_schemas_repository.get_layers_schemas(db):
+            layer_schemas_strs.append('"{}": {}'.format(schema.layer_type, schema.layer_schema))
+
+        body = ("{" + ",".join(layer_schemas_strs) + "}").encode()
+
+        return cls._make_snapshot(version, body)
+
+    @staticmethod
+    def _make_snapshot(version: int, body: bytes) -> LayersSchemasSnapshot:
+        schemas = json.loads(body)
+
+        validators = LayerValidatorsRegistry()
+        validators.load(schemas, source=version)
+        etag = '"{}-{}"'.format(version, hashlib.sha1(body).hexdigest()[:16])
+
+        return LayersSchemasSnapshot(version, schemas, body, etag, validators)
+
+
+layers_schemas_cache = LayersSchemasCache()
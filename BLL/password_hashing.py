@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from sqlalchemy_utils.types.password import Password
+
+from configs import PASSWORD_HASHING_THREADS
+from DAL.db_models import password_context
+
+
+class PasswordHashing:
+    """
+    Runs password hashing and verification (deliberately slow) in a bounded thread pool off the event loop
+    and keeps track of the time spent on them.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.hashed = 0
+        self.verified = 0
+        self.rehashed = 0
+        self.time_total = 0.0
+        self.time_max = 0.0
+
+    async def hash(self, secret: str) -> Password:
+        hashed = await self._run(password_context.hash, secret)
+        with self._lock:
+            self.hashed += 1
+
+        # already hashed - assigning it to `User.hashed_password` won't hash it again
+        return Password(hashed)
+
+    async def verify(self, password: Password, secret: str) -> bool:
+        """
+        Also replaces the hash with the one of the currently configured cost when it differs,
+        the password then is marked as changed and has to be saved.
+        """
+        old_hash = password.hash
+        valid = await self._run(password.__eq__, secret)
+        with self._lock:
+            self.verified += 1
+            if valid and password.hash != old_hash:
+                self.rehashed += 1
+
+        return valid
+
+    async def _run(self, fn: Callable, *args):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='password-hashing')
+
+        return await asyncio.get_event_loop().run_in_executor(self._executor, self._timed, fn, *args)
+
+    def _timed(self, fn: Callable, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.time_total += elapsed
+                self.time_max = max(self.time_max, elapsed)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                max_workers=self.max_workers,
+                hashed=self.hashed,
+                verified=self.verified,
+                rehashed=self.rehashed,
+                time_total_ms=round(self.time_total * 1000, 3),
+                time_max_ms=round(self.time_max * 1000, 3),
+            )
+
+
+password_hashing = PasswordHashing(PASSWORD_HASHING_THREADS)
@@ -0,0 +1,158 @@
+"""
+Per-request timing of the export pipeline stages: reported in the `Server-Timing` header of the response
+and accumulated into histograms served in the Prometheus text format.
+With timing disabled no timer is ever started and `stage` costs a single context variable lookup.
+"""
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+_current_timer = ContextVar('stage_timer', default=None)
+
+# seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# upper bounds of the layer count label values
+LAYERS_BUCKETS = (10, 100, 1000, 10000)
+
+
+class StageTimer:
+    __slots__ = ('start', 'stages', 'framework', 'num_layers')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # stage -> seconds, in the order the stages were run
+        self.stages: Dict[str, float] = {}
+        self.framework: str = None
+        self.num_layers: int = None
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        return ", ".join("{};dur={:.3f}".format(name, seconds * 1000) for name, seconds in self.stages.items())
+
+
+class _Stage:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer: StageTimer, name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str):
+    """
+    `with stage('validate'): ...` adds the time spent in the block to the current request's timer, if any.
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        return _NO_STAGE
+
+    return _Stage(timer, name)
+
+
+def current_timer() -> Optional[StageTimer]:
+    return _current_timer.get()
+
+
+def start_timer():
+    """
+    Returns the token to pass to `stop_timer`.
+    """
+    return _current_timer.set(StageTimer())
+
+
+def stop_timer(token) -> StageTimer:
+    timer = _current_timer.get()
+    _current_timer.reset(token)
+
+    return timer
+
+
+def record_since_start(name: str):
+    # for what happens before the endpoint is called (reading and parsing the request), recorded once
+    timer = _current_timer.get()
+    if timer is not None and name not in timer.stages:
+        timer.add(name, time.perf_counter() - timer.start)
+
+
+def label_export(framework: str, num_layers: int):
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.framework = framework
+        timer.num_layers = num_layers
+
+
+def layers_bucket(num_layers: Optional[int]) -> str:
+    if num_layers is None:
+        return "unknown"
+
+    lower = 1
+    for upper in LAYERS_BUCKETS:
+        if num_layers <= upper:
+            return "{}-{}".format(lower, upper)
+        lower = upper + 1
+
+    return "{}+".format(lower)
+
+
+class StageHistograms:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # (stage, framework, layers bucket) -> [count per bucket..., +Inf count], sum
+        self._histograms: Dict[tuple, List] = {}
+
+    def observe(self, timer: StageTimer):
+        labels = (timer.framework or "unknown", layers_bucket(timer.num_layers))
+        with self._lock:
+            for name, seconds in timer.stages.items():
+                histogram = self._histograms.get((name,) + labels)
+                if histogram is None:
+                    histogram = self._histograms[(name,) + labels] = [[0] * (len(self.buckets) + 1), 0.0]
+
+                counts = histogram[0]
+                for i, upper in enumerate(self.buckets):
+                    if seconds <= upper:
+                        counts[i] += 1
+                counts[-1] += 1
+                histogram[1] += seconds
+
+    def prometheus_text(self, metric_name: str = 'nnio_export_stage_duration_seconds') -> str:
+        lines = [
+            "# HELP {} Time spent in the export pipeline stages.".format(metric_name),
+            "# TYPE {} histogram".format(metric_name),
+        ]
+        with self._lock:
+            for (name, framework, layers), (counts, total) in sorted(self._histograms.items()):
+                labels = 'stage="{}",framework="{}",layers="{}"'.format(name, framework, layers)
+                for upper, count in zip(self.buckets, counts):
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(metric_name, labels, upper, count))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(metric_name, labels, counts[-1]))
+                lines.append('{}_sum{{{}}} {}'.format(metric_name, labels, total))
+                lines.append('{}_count{{{}}} {}'.format(metric_name, labels, counts[-1]))
+
+        return "\n".join(lines) + "\n"
+
+
+stage_histograms = StageHistograms()
@@ -0,0 +1,149 @@
+import atexit
+import base64
+import json
+import logging
+import queue
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+
+# only the traffic worth replaying is recorded, never anything of the users and admin routes
+CAPTURED_PATHS_PREFIXES = ('/architecture/', '/sharing/')
+CAPTURED_HEADERS = (b'content-type', b'if-none-match')
+SENSITIVE_WORDS = ('token', 'password', 'secret', 'authorization')
+
+
+def is_sensitive(key: str) -> bool:
+    key = key.lower()
+    return any(word in key for word in SENSITIVE_WORDS)
+
+
+def sanitize(value):
+    if isinstance(value, dict):
+        return {k: '***' if is_sensitive(k) else sanitize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(v) for v in value]
+
+    return value
+
+
+def sanitize_query(query_string: bytes) -> str:
+    # names are checked decoded, the way the app sees them (`%74oken` is `token`)
+    params = parse_qsl(query_string.decode('latin-1'), keep_blank_values=True)
+
+    return urlencode([(name, value) for name, value in params if not is_sensitive(name)])
+
+
+class TrafficCaptureMiddleware:
+    """
+    Appends the export and share requests to a JSON Lines file, one request per line, to be replayed by
+    `python -m benchmarks.replay`. Only the content type and If-None-Match headers are kept, sensitive query
+    parameters and JSON body keys are dropped or masked.
+    The event loop only queues the captured requests, they are turned into records and written by a writer thread.
+    """
+
+    def __init__(self, app, path: str, queue_size: int = 10000):
+        self.app = app
+        self.path = path
+        # requests not captured because the writer fell behind
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._writer = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(CAPTURED_PATHS_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        body_chunks = []
+        status_code = None
+
+        async def capturing_receive():
+            message = await receive()
+            if message['type'] == 'http.request':
+                body_chunks.append(message.get('body', b''))
+            return message
+
+        async def capturing_send(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        start = time.time()
+        try:
+            await self.app(scope, capturing_receive, capturing_send)
+        finally:
+            self.capture((scope, b''.join(body_chunks), start, time.time(), status_code))
+
+    @staticmethod
+    def make_record(scope, body: bytes, start: float, end: float, status_code: int) -> dict:
+        headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope['headers'] if k in CAPTURED_HEADERS}
+        record = dict(
+            time=start,
+            duration_ms=round((end - start) * 1000, 3),
+            status=status_code,
+            method=scope['method'],
+            path=scope['path'],
+            query=sanitize_query(scope['query_string']),
+            headers=headers,
+        )
+
+        if headers.get('content-type', '').startswith('application/json'):
+            try:
+                record['json'] = sanitize(json.loads(body))
+                return record
+            except ValueError:
+                pass
+
+        # uploaded files (multipart) and anything else are kept as they are
+        record['body_base64'] = base64.b64encode(body).decode('ascii')
+
+        return record
+
+    def capture(self, request: tuple):
+        # never blocks the event loop: when the writer can't keep up, requests are not captured
+        if self._writer is None:
+            self._start_writer()
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """
+        Waits until everything captured so far is written.
+        """
+        if self._writer is not None:
+            self._queue.join()
+
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_records, name='traffic-capture', daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def _write_records(self):
+        file = None
+        while True:
+            requests = [self._queue.get()]
+            # whatever got queued meanwhile is written and flushed at once
+            while True:
+                try:
+                    requests.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                if file is None:
+                    file = open(self.path, 'a', encoding='utf-8')
+                for request in requests:
+                    file.write(json.dumps(self.make_record(*request), separators=(',', ':')) + "\n")
+                file.flush()
+            except Exception:
+                logging.exception("Could not write captured requests to %s", self.path)
+            finally:
+                for _ in requests:
+                    self._queue.task_done()
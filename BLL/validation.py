@@ -0,0 +1,81 @@
+from typing import Dict, Iterable, List, NamedTuple, Union
+
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+
+class LayerValidationError(NamedTuple):
+    layer_name: str
+    path: str
+    message: str
+
+    def __str__(self):
+        return f'Layer "{self.layer_name}" at {self.path}: {self.message}'
+
+
+def json_path(path: Iterable[Union[str, int]]) -> str:
+    res = "$"
+    for p in path:
+        if isinstance(p, int):
+            res += f"[{p}]"
+        else:
+            res += f".{p}"
+
+    return res
+
+
+class LayerValidatorsRegistry:
+    """
+    Compiles every layer schema into a reusable validator only once (schema itself is checked at that moment too),
+    instead of `jsonschema.validate` doing both for every validated layer.
+    """
+
+    def __init__(self):
+        self._source = None
+        self._schemas: Dict[str, dict] = {}
+        self._validators = {}
+
+    def load(self, layer_schemas: Dict[str, dict], source=None):
+        # `source` identifies the loaded schemas - loading the same source again keeps already compiled validators
+        if source is not None and source == self._source:
+            return
+
+        self._schemas = layer_schemas
+        self._validators = {}
+        self._source = source
+
+    def invalidate(self):
+        self._source = None
+        self._schemas = {}
+        self._validators = {}
+
+    def __contains__(self, layer_type: str):
+        return layer_type in self._schemas
+
+    def get_validator(self, layer_type: str):
+        validator = self._validators.get(layer_type)
+        if validator is None:
+            schema = self._schemas[layer_type]
+            validator_cls = validator_for(schema)
+            validator_cls.check_schema(schema)
+            validator = validator_cls(schema)
+            self._validators[layer_type] = validator
+
+        return validator
+
+    def validate_layer(self, layer_name: str, layer_type: str, layer: dict, collect_all: bool = False) \
+            -> List[Union[str, LayerValidationError]]:
+        """
+        Returns a list of errors: a single best matching error (as `jsonschema.validate` would raise)
+        or, with `collect_all`, every error found with the layer name and JSON path of the invalid value.
+        """
+        if layer_type not in self._schemas:
+            return [LayerValidationError(layer_name, json_path(['type']), f'Unknown layer type "{layer_type}"')]
+
+        errors = self.get_validator(layer_type).iter_errors(layer)
+        if not collect_all:
+            error = best_match(errors)
+            return [] if error is None else [str(error)]
+
+        return [LayerValidationError(layer_name, json_path(e.absolute_path), e.message) for e in errors]
+
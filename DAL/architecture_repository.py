@@ -1,16 +1,133 @@
+import base64
+import hashlib
+import json
+import zlib
+from typing import Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from DAL import schemas, db_models
 
+# format marker of compressed payloads: "z:" + base64 of zlib-compressed JSON,
+# rows stored before it was introduced hold the plain JSON (which never starts with it)
+COMPRESSED_PREFIX = "z:"
+
+
+def canonical_architecture_json(architecture: dict) -> str:
+    # keys are not sorted - the order of layer params is the order of generated keyword arguments
+    return json.dumps(architecture, separators=(',', ':'), ensure_ascii=False)
+
+
+def encode_architecture_data(architecture: str) -> str:
+    compressed = zlib.compress(architecture.encode(), 9)
+    return COMPRESSED_PREFIX + base64.b64encode(compressed).decode('ascii')
+
+
+def decode_architecture_data(data: str) -> str:
+    if not data.startswith(COMPRESSED_PREFIX):
+        return data
+
+    return zlib.decompress(base64.b64decode(data[len(COMPRESSED_PREFIX):])).decode()
+
+
+def architecture_content_hash(architecture: dict) -> str:
+    # only what the architecture is made of, the same one shared again with a new `id` or `date_created` is a duplicate
+    content = dict(name=architecture.get('name'), layers=architecture.get('layers'))
+    return hashlib.sha256(canonical_architecture_json(content).encode()).hexdigest()
+
+
+def add_content_hash_column(connectable):
+    """
+    `create_all` doesn't add columns to existing tables: the tables created before deduplication get it here.
+    """
+    columns = [c['name'] for c in inspect(connectable).get_columns(db_models.Architecture.__tablename__)]
+    if 'content_hash' in columns:
+        return False
+
+    connectable.execute(text('ALTER TABLE architectures ADD COLUMN content_hash VARCHAR(64)'))
+    connectable.execute(text('CREATE UNIQUE INDEX ix_architectures_content_hash ON architectures (content_hash)'))
+
+    return True
+
 
 def get_architecture_by_id(db: Session, arch_id: int) -> db_models.Architecture:
     return db.query(db_models.Architecture).filter(db_models.Architecture.id == arch_id).first()
 
 
-def store_new_architecture(db: Session, architecture: str) -> db_models.Architecture:
-    db_architecture = db_models.Architecture(data=architecture)
+def get_architecture_data(db: Session, arch_id: int) -> Optional[str]:
+    data = db.query(db_models.Architecture.data).filter(db_models.Architecture.id == arch_id).scalar()
+
+    return None if data is None else decode_architecture_data(data)
+
+
+def get_architecture_id_by_hash(db: Session, content_hash: str) -> Optional[int]:
+    return db.query(db_models.Architecture.id).filter(db_models.Architecture.content_hash == content_hash).scalar()
+
+
+def store_architecture(db: Session, architecture: dict) -> int:
+    """
+    Stores the architecture (as canonical JSON) unless the same one is stored already, returns its id either way.
+    """
+    content_hash = architecture_content_hash(architecture)
+    arch_id = get_architecture_id_by_hash(db, content_hash)
+    if arch_id is not None:
+        return arch_id
+
+    data = encode_architecture_data(canonical_architecture_json(architecture))
+    db_architecture = db_models.Architecture(data=data, content_hash=content_hash)
     db.add(db_architecture)
-    db.commit()
-    db.refresh(db_architecture)
+    try:
+        db.commit()
+    except IntegrityError:
+        # the same architecture was shared concurrently
+        db.rollback()
+        return get_architecture_id_by_hash(db, content_hash)
+
+    return db_architecture.id
+
+
+def compact_architectures(db: Session, batch_size: int = 500) -> dict:
+    """
+    One-off migration of the rows stored before deduplication: hashes and compresses every row.
+    Duplicates keep their ids (links to them must keep working), only the first row of every architecture
+    gets the hash.
+    """
+    add_content_hash_column(db.get_bind())
+
+    stats = dict(compacted=0, duplicates=0, bytes_before=0, bytes_after=0)
+    last_id = 0
+    while True:
+        rows = db.query(db_models.Architecture) \
+            .filter(db_models.Architecture.id > last_id) \
+            .order_by(db_models.Architecture.id) \
+            .limit(batch_size) \
+            .all()
+        if not rows:
+            break
+
+        for row in rows:
+            last_id = row.id
+            if row.data is None or row.data.startswith(COMPRESSED_PREFIX):
+                continue
+
+            # old rows were serialized with the default separators
+            architecture_dict = json.loads(row.data)
+            architecture = canonical_architecture_json(architecture_dict)
+            content_hash = architecture_content_hash(architecture_dict)
+            if get_architecture_id_by_hash(db, content_hash) is None:
+                row.content_hash = content_hash
+            else:
+                stats['duplicates'] += 1
+
+            stats['bytes_before'] += len(row.data)
+            row.data = encode_architecture_data(architecture)
+            stats['bytes_after'] += len(row.data)
+            stats['compacted'] += 1
+            # so that the hash lookups see the rows of this batch too
+            db.flush()
+
+        db.commit()
 
-    return db_architecture
+    return stats
@@ -3,6 +3,8 @@ from sqlalchemy import Boolean, Column, Integer, String
 from sqlalchemy_utils.types.password import PasswordType
 from sqlalchemy_utils import force_auto_coercion
 
+from configs import PASSWORD_HASH_ROUNDS
+
 force_auto_coercion()
 
 Base = declarative_base()
@@ -17,9 +19,15 @@ class User(Base):
         schemes=[
             'pbkdf2_sha512',
         ],
+        pbkdf2_sha512__default_rounds=PASSWORD_HASH_ROUNDS,
+        pbkdf2_sha512__min_rounds=PASSWORD_HASH_ROUNDS,
+        pbkdf2_sha512__max_rounds=PASSWORD_HASH_ROUNDS,
     ))
 
 
+password_context = User.hashed_password.property.columns[0].type.context
+
+
 class LayerSchema(Base):
     __tablename__ = 'layers_schemas'
 
@@ -27,8 +35,17 @@ class LayerSchema(Base):
     layer_schema = Column(String)
 
 
+class LayersSchemasVersion(Base):
+    __tablename__ = 'layers_schemas_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
 class Architecture(Base):
     __tablename__ = 'architectures'
 
     id = Column(Integer, primary_key=True, index=True)
     data = Column(String)
+    # sha256 of the canonical JSON, left empty for duplicates stored before deduplication
+    content_hash = Column(String(64), unique=True, index=True)
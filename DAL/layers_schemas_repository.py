@@ -0,0 +1,38 @@
+from typing import Dict, List
+
+from sqlalchemy.orm import Session
+
+from DAL import db_models
+
+VERSION_ROW_ID = 1
+
+
+def get_layers_schemas_version(db: Session) -> int:
+    version = db.query(db_models.LayersSchemasVersion.version) \
+        .filter(db_models.LayersSchemasVersion.id == VERSION_ROW_ID) \
+        .scalar()
+
+    return version or 0
+
+
+def get_layers_schemas(db: Session) -> List[db_models.LayerSchema]:
+    return db.query(db_models.LayerSchema).all()
+
+
+def replace_layers_schemas(db: Session, layers_schemas: Dict[str, str]) -> int:
+    db.query(db_models.LayerSchema).delete()
+
+    for layer_type, layer_schema in layers_schemas.items():
+        db.add(db_models.LayerSchema(layer_type=layer_type, layer_schema=layer_schema))
+
+    # bumped in the same transaction, so other workers never see new schemas under the old version
+    updated = db.query(db_models.LayersSchemasVersion) \
+        .filter(db_models.LayersSchemasVersion.id == VERSION_ROW_ID) \
+        .update({db_models.LayersSchemasVersion.version: db_models.LayersSchemasVersion.version + 1},
+                synchronize_session=False)
+    if not updated:
+        db.add(db_models.LayersSchemasVersion(id=VERSION_ROW_ID, version=1))
+
+    db.commit()
+
+    return get_layers_schemas_version(db)
@@ -0,0 +1,99 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+
+class PoolMetrics:
+    """
+    Counters of the engine's connection pool events, plus the time spent waiting for a connection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engine = None
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def instrument(self, engine: Engine):
+        self._engine = engine
+
+        # listening on the engine, the pool it recreates (e.g. on `engine.dispose()`) gets the same listeners
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+        event.listen(engine, 'invalidate', self._on_invalidate)
+        event.listen(engine, 'soft_invalidate', self._on_soft_invalidate)
+
+    @contextmanager
+    def checkout_wait(self):
+        """
+        Measures the wait for a connection around its checkout: there is no pool event before a checkout starts.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except PoolTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise
+        finally:
+            self._add_wait_time(time.perf_counter() - start)
+
+    def _add_wait_time(self, wait_time: float):
+        with self._lock:
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def _on_soft_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.soft_invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(
+                connects=self.connects,
+                checkouts=self.checkouts,
+                checkins=self.checkins,
+                invalidations=self.invalidations,
+                soft_invalidations=self.soft_invalidations,
+                timeouts=self.timeouts,
+                wait_time_total_ms=round(self.wait_time_total * 1000, 3),
+                wait_time_max_ms=round(self.wait_time_max * 1000, 3),
+            )
+
+        # current state, only `QueuePool` keeps track of it
+        pool = self._engine.pool if self._engine is not None else None
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            gauge = getattr(pool, name, None)
+            stats[name] = gauge() if callable(gauge) else None
+
+        return stats
+
+
+pool_metrics = PoolMetrics()
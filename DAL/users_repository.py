@@ -1,4 +1,5 @@
 from sqlalchemy.orm import Session
+from sqlalchemy_utils.types.password import Password
 
 from DAL import db_models, schemas
 
@@ -15,8 +16,10 @@ def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(db_models.User).offset(skip).limit(limit).all()
 
 
-def create_user(db: Session, user: schemas.UserCreate):
-    db_user = db_models.User(email=user.email, hashed_password=user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: Password = None):
+    # the plain password gets hashed on flush, unless it was hashed beforehand
+    db_user = db_models.User(email=user.email,
+                             hashed_password=user.password if hashed_password is None else hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
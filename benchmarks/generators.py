@@ -0,0 +1,133 @@
+"""
+Synthetic architectures in the `ArchitectureDataModel` JSON format (what the frontend sends).
+"""
+import random
+from typing import List
+
+
+def architecture(name: str, layers: List[dict], shuffle_seed: int = None) -> dict:
+    if shuffle_seed is not None:
+        # the order of layers in a request is arbitrary
+        layers = list(layers)
+        random.Random(shuffle_seed).shuffle(layers)
+
+    return dict(date_created="2019-07-21 18:45:23", id="benchmark", name=name, layers=layers)
+
+
+def layer(name: str, layer_type: str, inputs: List[str], **params) -> dict:
+    return dict(name=name, type=layer_type, inputs=inputs, params=params)
+
+
+def chain(num_layers: int, **kwargs) -> dict:
+    """
+    Input -> Dense -> ... -> Dense, exportable as a Sequential model.
+    """
+    layers = [layer("input", "Input", [], shape=[784])]
+    for i in range(1, num_layers):
+        layers.append(layer(f"dense_{i}", "Dense", [layers[-1]['name']], units=64, activation="relu"))
+
+    return architecture(f"Chain{num_layers}", layers, **kwargs)
+
+
+def fan_out_fan_in(width: int, depth: int, **kwargs) -> dict:
+    """
+    `width` parallel branches of `depth` layers each, all starting at one input and merged by one Concatenate.
+    """
+    layers = [layer("input", "Input", [], shape=[784])]
+    branch_outputs = []
+    for b in range(width):
+        previous = "input"
+        for d in range(depth):
+            name = f"branch_{b}_dense_{d}"
+            layers.append(layer(name, "Dense", [previous], units=32, activation="relu"))
+            previous = name
+        branch_outputs.append(previous)
+
+    layers.append(layer("concatenate", "Concatenate", branch_outputs))
+    layers.append(layer("output", "Dense", ["concatenate"], units=10, activation="softmax"))
+
+    return architecture(f"FanOutFanIn{width}x{depth}", layers, **kwargs)
+
+
+def resnet(num_blocks: int, **kwargs) -> dict:
+    """
+    ResNet-style residual blocks: two convolutions with batch normalization plus a skip connection each.
+    """
+    layers = [
+        layer("input", "Input", [], shape=[224, 224, 3]),
+        layer("stem", "Conv2D", ["input"], filters=64, kernel_size=[7, 7], strides=[2, 2], padding="same"),
+    ]
+    previous = "stem"
+    for b in range(num_blocks):
+        p = f"block_{b}"
+        layers += [
+            layer(f"{p}_conv_1", "Conv2D", [previous], filters=64, kernel_size=[3, 3], padding="same"),
+            layer(f"{p}_bn_1", "BatchNormalization", [f"{p}_conv_1"]),
+            layer(f"{p}_relu_1", "Activation", [f"{p}_bn_1"], activation="relu"),
+            layer(f"{p}_conv_2", "Conv2D", [f"{p}_relu_1"], filters=64, kernel_size=[3, 3], padding="same"),
+            layer(f"{p}_bn_2", "BatchNormalization", [f"{p}_conv_2"]),
+            layer(f"{p}_add", "Add", [f"{p}_bn_2", previous]),
+            layer(f"{p}_relu_2", "Activation", [f"{p}_add"], activation="relu"),
+        ]
+        previous = f"{p}_relu_2"
+
+    layers += [
+        layer("pool", "GlobalAveragePooling2D", [previous]),
+        layer("output", "Dense", ["pool"], units=1000, activation="softmax"),
+    ]
+
+    return architecture(f"ResNet{num_blocks}", layers, **kwargs)
+
+
+def inception(num_blocks: int, **kwargs) -> dict:
+    """
+    Inception-style blocks: four parallel towers merged by a Concatenate.
+    """
+    layers = [layer("input", "Input", [], shape=[224, 224, 3])]
+    previous = "input"
+    for b in range(num_blocks):
+        p = f"block_{b}"
+        layers += [
+            layer(f"{p}_1x1", "Conv2D", [previous], filters=64, kernel_size=[1, 1], padding="same"),
+            layer(f"{p}_3x3_reduce", "Conv2D", [previous], filters=96, kernel_size=[1, 1], padding="same"),
+            layer(f"{p}_3x3", "Conv2D", [f"{p}_3x3_reduce"], filters=128, kernel_size=[3, 3], padding="same"),
+            layer(f"{p}_5x5_reduce", "Conv2D", [previous], filters=16, kernel_size=[1, 1], padding="same"),
+            layer(f"{p}_5x5", "Conv2D", [f"{p}_5x5_reduce"], filters=32, kernel_size=[5, 5], padding="same"),
+            layer(f"{p}_pool", "MaxPooling2D", [previous], pool_size=[3, 3], strides=[1, 1], padding="same"),
+            layer(f"{p}_pool_proj", "Conv2D", [f"{p}_pool"], filters=32, kernel_size=[1, 1], padding="same"),
+            layer(f"{p}_concatenate", "Concatenate", [f"{p}_1x1", f"{p}_3x3", f"{p}_5x5", f"{p}_pool_proj"]),
+        ]
+        previous = f"{p}_concatenate"
+
+    layers += [
+        layer("pool", "GlobalAveragePooling2D", [previous]),
+        layer("output", "Dense", ["pool"], units=1000, activation="softmax"),
+    ]
+
+    return architecture(f"Inception{num_blocks}", layers, **kwargs)
+
+
+def random_dag(num_layers: int, num_inputs: int = 2, window: int = 16, seed: int = 0, **kwargs) -> dict:
+    """
+    Every layer takes one or two of the `window` previous layers as inputs, all dangling layers are merged
+    into a single output at the end.
+    """
+    rnd = random.Random(seed)
+    layers = [layer(f"input_{i}", "Input", [], shape=[rnd.randint(1, 512)]) for i in range(num_inputs)]
+    unused = {l['name'] for l in layers}
+    for i in range(num_inputs, num_layers - 1):
+        candidates = [l['name'] for l in layers[-window:]]
+        inputs = rnd.sample(candidates, min(len(candidates), rnd.choice([1, 1, 1, 2])))
+        if len(inputs) > 1:
+            new_layer = layer(f"concatenate_{i}", "Concatenate", inputs)
+        else:
+            new_layer = layer(f"dense_{i}", "Dense", inputs, units=rnd.randint(1, 256), activation="relu")
+        layers.append(new_layer)
+        unused.difference_update(inputs)
+        unused.add(new_layer['name'])
+
+    outputs = sorted(unused)
+    if len(outputs) > 1:
+        layers.append(layer("output", "Concatenate", outputs))
+
+    return architecture(f"RandomDag{num_layers}", layers, **kwargs)
@@ -0,0 +1,189 @@
+"""
+Replays requests captured by the traffic capture middleware (`TRAFFIC_CAPTURE_PATH`) and reports throughput,
+latency percentiles and errors per endpoint. Either in-process, straight through the ASGI app
+(needs the same environment as the server), or against a running server:
+
+    python -m benchmarks.replay traffic.jsonl --concurrency 8 --rate 50
+    python -m benchmarks.replay traffic.jsonl --url http://localhost:8000 --concurrency 32 --repeat 5
+"""
+import argparse
+import asyncio
+import base64
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+
+def load_records(path: str) -> List[dict]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def record_body(record: dict) -> bytes:
+    if 'json' in record:
+        return json.dumps(record['json']).encode()
+
+    return base64.b64decode(record.get('body_base64', ''))
+
+
+class InProcessClient:
+    """
+    Calls the ASGI app directly, concurrent requests share the event loop the same way they do in a server worker.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, record: dict) -> int:
+        body = record_body(record)
+        scope = dict(
+            type='http',
+            http_version='1.1',
+            method=record['method'],
+            scheme='http',
+            path=record['path'],
+            raw_path=record['path'].encode(),
+            root_path='',
+            query_string=record.get('query', '').encode(),
+            headers=[(k.encode('latin-1'), v.encode('latin-1')) for k, v in record.get('headers', {}).items()] +
+                    [(b'host', b'replay'), (b'content-length', str(len(body)).encode())],
+            server=('replay', 80),
+            client=('127.0.0.1', 0),
+        )
+        body_sent = False
+        status_code = None
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return dict(type='http.request', body=body, more_body=False)
+            # the response is complete long before this would matter
+            await asyncio.sleep(3600)
+            return dict(type='http.disconnect')
+
+        async def send(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+
+        await self.app(scope, receive, send)
+
+        return status_code
+
+
+class HttpClient:
+    def __init__(self, url: str, concurrency: int):
+        import requests
+
+        self.url = url.rstrip('/')
+        self._session = requests.Session()
+        self._session.mount(self.url, requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+        self._executor = ThreadPoolExecutor(concurrency)
+
+    def _request(self, record: dict) -> int:
+        url = self.url + record['path'] + ('?' + record['query'] if record.get('query') else '')
+        response = self._session.request(record['method'], url, data=record_body(record),
+                                         headers=record.get('headers', {}))
+        return response.status_code
+
+    async def request(self, record: dict) -> int:
+        return await asyncio.get_event_loop().run_in_executor(self._executor, self._request, record)
+
+
+async def replay(client, records: List[dict], concurrency: int, rate: float) -> Tuple[float, Dict[str, dict]]:
+    """
+    Sends the requests in the recorded order, at most `concurrency` at once and, with a `rate`, no more than
+    that many per second (each request gets its own start slot, as in an open workload).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results: Dict[str, dict] = {}
+    start = time.perf_counter()
+
+    async def send_one(i: int, record: dict):
+        if rate:
+            await asyncio.sleep(max(0.0, start + i / rate - time.perf_counter()))
+
+        async with semaphore:
+            request_start = time.perf_counter()
+            try:
+                status_code = await client.request(record)
+            except Exception:
+                status_code = None
+            latency = time.perf_counter() - request_start
+
+        endpoint = results.setdefault(record['method'] + " " + record['path'], dict(latencies=[], statuses={}))
+        endpoint['latencies'].append(latency)
+        endpoint['statuses'][status_code] = endpoint['statuses'].get(status_code, 0) + 1
+
+    await asyncio.gather(*(send_one(i, record) for i, record in enumerate(records)))
+
+    return time.perf_counter() - start, results
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    # nearest-rank
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def report(elapsed: float, results: Dict[str, dict]) -> dict:
+    endpoints = {}
+    for endpoint, result in sorted(results.items()):
+        latencies = sorted(result['latencies'])
+        statuses = result['statuses']
+        endpoints[endpoint] = dict(
+            requests=len(latencies),
+            throughput_rps=round(len(latencies) / elapsed, 3),
+            p50_ms=round(percentile(latencies, 50) * 1000, 3),
+            p95_ms=round(percentile(latencies, 95) * 1000, 3),
+            p99_ms=round(percentile(latencies, 99) * 1000, 3),
+            # 4xx are part of the recorded traffic (invalid models), only server errors and failures count
+            errors=sum(n for status, n in statuses.items() if status is None or status >= 500),
+            statuses={str(status): n for status, n in sorted(statuses.items(), key=lambda x: str(x[0]))},
+        )
+
+    total = sum(e['requests'] for e in endpoints.values())
+
+    return dict(elapsed_s=round(elapsed, 3), requests=total, throughput_rps=round(total / elapsed, 3),
+                endpoints=endpoints)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="replay captured nnio traffic")
+    parser.add_argument('traffic', help="JSON Lines file written by the traffic capture middleware")
+    parser.add_argument('--url', help="base URL of a running server, the app is called in-process without it")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0, help="requests per second, 0 for as fast as possible")
+    parser.add_argument('--repeat', type=int, default=1, help="replay the captured requests this many times")
+    parser.add_argument('--output', help="also write the report as JSON into this file")
+    args = parser.parse_args(argv)
+
+    records = load_records(args.traffic) * args.repeat
+    if args.url:
+        client = HttpClient(args.url, args.concurrency)
+    else:
+        from main import app
+        client = InProcessClient(app)
+
+    elapsed, results = asyncio.get_event_loop().run_until_complete(
+        replay(client, records, args.concurrency, args.rate))
+    summary = report(elapsed, results)
+
+    print("{:<55} {:>8} {:>10} {:>10} {:>10} {:>10} {:>7}".format(
+        "endpoint", "requests", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors"))
+    for endpoint, e in summary['endpoints'].items():
+        print("{:<55} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>7}".format(
+            endpoint, e['requests'], e['throughput_rps'], e['p50_ms'], e['p95_ms'], e['p99_ms'], e['errors']))
+    print("total: {} requests in {:.2f} s, {:.2f} req/s".format(
+        summary['requests'], summary['elapsed_s'], summary['throughput_rps']), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
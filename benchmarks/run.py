@@ -0,0 +1,174 @@
+"""
+Export pipeline benchmarks, run from the repository root against the configured database
+(it must be initialized and contain the layers schemas, same as for the server):
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --quick --baseline results.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks import generators
+
+# (case name, function generating the architecture of the case), in the order the cases run
+FULL_CASES = [
+    ("chain_1000", lambda: generators.chain(1000)),
+    ("chain_10000", lambda: generators.chain(10000)),
+    ("fan_out_fan_in_100x10", lambda: generators.fan_out_fan_in(100, 10)),
+    ("fan_out_fan_in_100x100", lambda: generators.fan_out_fan_in(100, 100, shuffle_seed=0)),
+    ("resnet_50", lambda: generators.resnet(50)),
+    ("resnet_1500", lambda: generators.resnet(1500, shuffle_seed=0)),
+    ("inception_40", lambda: generators.inception(40)),
+    ("inception_1250", lambda: generators.inception(1250, shuffle_seed=0)),
+    ("random_dag_10000", lambda: generators.random_dag(10000, shuffle_seed=0)),
+]
+QUICK_CASES = [
+    ("chain_200", lambda: generators.chain(200)),
+    ("fan_out_fan_in_10x10", lambda: generators.fan_out_fan_in(10, 10)),
+    ("resnet_10", lambda: generators.resnet(10)),
+    ("inception_10", lambda: generators.inception(10, shuffle_seed=0)),
+    ("random_dag_1000", lambda: generators.random_dag(1000, shuffle_seed=0)),
+]
+
+
+def measure(fn: Callable, repeat: int, setup: Callable = None) -> Dict[str, float]:
+    times = []
+    # one warm-up run, caches (validators, literals) are warm in a running server too
+    for i in range(repeat + 1):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if i:
+            times.append(elapsed * 1000)
+
+    return dict(
+        min_ms=round(min(times), 3),
+        median_ms=round(statistics.median(times), 3),
+        mean_ms=round(statistics.mean(times), 3),
+        repeat=repeat,
+    )
+
+
+def case_benchmarks(architecture: dict, layers_schemas, client) -> List[Tuple[str, Callable, Callable]]:
+    from BLL.exporting.export_cache import export_cache
+    from BLL.exporting.model_exporting import export_model
+    from models import NetworkModel, parse_architecture
+    from routers.architecture_exporting import validate_model, validate_is_acyclic
+
+    model = parse_architecture(architecture)
+    net_model = NetworkModel.from_data_model(model)
+
+    benchmarks = [
+        ("parse", lambda: parse_architecture(architecture), None),
+        ("validate_model", lambda: validate_model(model, layers_schemas.validators), None),
+        ("link_layers", lambda: NetworkModel._link_layers(model.layers), None),
+        ("validate_is_acyclic", lambda: validate_is_acyclic(net_model), None),
+        ("export_functional", lambda: export_model(net_model, "keras", "\n", " " * 4), None),
+    ]
+    if all(net_model.out_degree(i) <= 1 and net_model.in_degree(i) <= 1 for i in range(len(net_model))):
+        benchmarks.append(("export_sequential", lambda: export_model(net_model, "keras", "\n", " " * 4,
+                                                                     keras_prefer_sequential=True), None))
+
+    def http_export():
+        response = client.post('/architecture/export-from-json-body?framework=keras', json=architecture)
+        assert response.status_code == 200, response.text
+
+    # the export cache would turn every run after the first one into a lookup
+    benchmarks.append(("http_export", http_export, export_cache.clear))
+
+    return benchmarks
+
+
+def run(cases, repeat: int, only: str = None) -> dict:
+    from starlette.testclient import TestClient
+
+    from BLL.layers_schemas import layers_schemas_cache
+    from configs import SessionLocal
+    from main import app
+
+    db = SessionLocal()
+    try:
+        layers_schemas = layers_schemas_cache.get(db)
+    finally:
+        db.close()
+
+    client = TestClient(app)
+    results = {}
+    for case_name, make_architecture in cases:
+        architecture = make_architecture()
+        for benchmark_name, fn, setup in case_benchmarks(architecture, layers_schemas, client):
+            name = f"{case_name}/{benchmark_name}"
+            if only and only not in name:
+                continue
+
+            results[name] = dict(measure(fn, repeat, setup), layers=len(architecture['layers']))
+            print(f"{name:<45} {results[name]['median_ms']:>12.3f} ms", file=sys.stderr)
+
+    return dict(
+        meta=dict(
+            created=datetime.utcnow().isoformat(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            repeat=repeat,
+        ),
+        results=results,
+    )
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    Prints median times against the baseline ones, returns names of the benchmarks slower by more than `threshold`.
+    """
+    regressions = []
+    for name, result in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f"{name:<45} {result['median_ms']:>12.3f} ms  (new)")
+            continue
+
+        ratio = result['median_ms'] / base['median_ms'] if base['median_ms'] else float('inf')
+        mark = ""
+        if ratio > threshold:
+            mark = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<45} {base['median_ms']:>12.3f} -> {result['median_ms']:>12.3f} ms  x{ratio:.2f}{mark}")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="nnio export benchmarks")
+    parser.add_argument('--quick', action='store_true', help="small models only")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', help="run the benchmarks having this substring in the name only")
+    parser.add_argument('--output', help="write the results as JSON into this file (stdout by default)")
+    parser.add_argument('--baseline', help="results JSON to compare with")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="median time ratio above which a benchmark counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run(QUICK_CASES if args.quick else FULL_CASES, args.repeat, args.only)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    elif not args.baseline:
+        json.dump(results, sys.stdout, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,11 @@
 import logging
 import os
 
-import DAL
-
-from DAL import db_models
 from sqlalchemy import create_engine, Table
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool
+
+from DAL.pool_metrics import pool_metrics
 
 origins = [
     "http://localhost:8080",
@@ -21,8 +21,74 @@ logging.basicConfig(
 
 SQLALCHEMY_DATABASE_URL = os.environ['DATABASE_URL']
 
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'yes')
+
+
+def engine_options(url: str):
+    options = dict(pool_pre_ping=DB_POOL_PRE_PING, pool_recycle=DB_POOL_RECYCLE)
+    if url.startswith('sqlite'):
+        # sessions are used from the threadpool, not from the thread that opened the connection
+        options['connect_args'] = dict(check_same_thread=False)
+        if ':memory:' in url or url.rstrip('/') == 'sqlite:':
+            # every pooled connection would be a separate empty database
+            return options
+
+        # a file database gets the same pool as on the server instead of the `NullPool` default
+        options['poolclass'] = QueuePool
+
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+    SQLALCHEMY_DATABASE_URL,
+    **engine_options(SQLALCHEMY_DATABASE_URL)
 )
+pool_metrics.instrument(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-DAL.db_models.Base.metadata.create_all(bind=engine)
+
+
+def init_db():
+    # explicit startup step (`python manage.py init-db`), importing the app never touches the DB;
+    # the DAL models read their settings from this module, so they are imported here
+    from DAL import db_models, architecture_repository
+
+    db_models.Base.metadata.create_all(bind=engine)
+    architecture_repository.add_content_hash_column(engine)
+
+
+# per-stage export timings in the `Server-Timing` header and the Prometheus metrics
+STAGE_TIMING_ENABLED = os.environ.get('STAGE_TIMING_ENABLED', '1').lower() in ('1', 'true', 'yes')
+# opt-in: export and share requests are appended to this JSON Lines file (see `python -m benchmarks.replay`)
+TRAFFIC_CAPTURE_PATH = os.environ.get('TRAFFIC_CAPTURE_PATH')
+EXPORT_CACHE_SIZE = int(os.environ.get('EXPORT_CACHE_SIZE', 256))
+# linked architectures the patch exports (`/architecture/export-from-patch`) can start from
+ARCHITECTURE_GRAPHS_CACHE_SIZE = int(os.environ.get('ARCHITECTURE_GRAPHS_CACHE_SIZE', 64))
+LOADED_ARCHITECTURES_CACHE_SIZE = int(os.environ.get('LOADED_ARCHITECTURES_CACHE_SIZE', 256))
+AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 1024))
+AUTH_CACHE_TTL = float(os.environ.get('AUTH_CACHE_TTL', 60))
+PASSWORD_HASHING_THREADS = int(os.environ.get('PASSWORD_HASHING_THREADS', 2))
+# a hash of a different cost gets replaced on the next successful login
+PASSWORD_HASH_ROUNDS = int(os.environ.get('PASSWORD_HASH_ROUNDS', 25000))
+# layers schemas saved by the last `init-db` or schemas edit, loaded on import instead of querying the DB
+LAYERS_SCHEMAS_SNAPSHOT_PATH = os.environ.get('LAYERS_SCHEMAS_SNAPSHOT_PATH', 'layers_schemas_snapshot.json')
+
+# exports of models with at least EXPORT_POOL_MIN_LAYERS layers run in a pool of EXPORT_POOL_SIZE processes
+# (0 disables it), up to EXPORT_POOL_QUEUE_DEPTH more wait for a free one
+EXPORT_POOL_SIZE = int(os.environ.get('EXPORT_POOL_SIZE', 1))
+EXPORT_POOL_QUEUE_DEPTH = int(os.environ.get('EXPORT_POOL_QUEUE_DEPTH', 8))
+EXPORT_POOL_TIMEOUT = float(os.environ.get('EXPORT_POOL_TIMEOUT', 30))
+EXPORT_POOL_MIN_LAYERS = int(os.environ.get('EXPORT_POOL_MIN_LAYERS', 200))
+
+# threads generating the code of streamed exports (`stream=1`), streams over it are rejected with 503;
+# a stream whose client takes no chunk for STREAM_EXPORT_STALL_TIMEOUT seconds is abandoned
+STREAM_EXPORT_THREADS = int(os.environ.get('STREAM_EXPORT_THREADS', 4))
+STREAM_EXPORT_STALL_TIMEOUT = float(os.environ.get('STREAM_EXPORT_STALL_TIMEOUT', 30))
+
+# models estimated to have more parameters or FLOPs per sample are rejected before the code is generated (0 - no limit)
+MAX_MODEL_PARAMS = int(os.environ.get('MAX_MODEL_PARAMS', 0))
+MAX_MODEL_FLOPS = int(os.environ.get('MAX_MODEL_FLOPS', 0))
@@ -1,3 +1,5 @@
+import time
+
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
@@ -7,6 +9,13 @@ import uvicorn
 
 from configs import *
 from routers import architecture_exporting, architecture_sharing, users, admin
+from routers.common import close_db
+from BLL.layers_schemas import layers_schemas_cache
+from BLL.stage_timing import start_timer, stop_timer, stage_histograms
+from BLL.traffic_capture import TrafficCaptureMiddleware
+
+# no DB access here: with `gunicorn --preload` this runs once and the workers share the loaded state
+layers_schemas_cache.load_snapshot_file(LAYERS_SCHEMAS_SNAPSHOT_PATH)
 
 app = FastAPI()
 app.add_middleware(
@@ -43,20 +52,48 @@ app.include_router(
 )
 
 
+@app.middleware("http")
+async def stage_timing_middleware(request: Request, call_next):
+    if not STAGE_TIMING_ENABLED:
+        return await call_next(request)
+
+    # the endpoint runs in a task created by `call_next`, which inherits the timer through its context
+    token = start_timer()
+    try:
+        response = await call_next(request)
+    finally:
+        timer = stop_timer(token)
+
+    if timer.stages:
+        timer.add('total', time.perf_counter() - timer.start)
+        response.headers['Server-Timing'] = timer.server_timing()
+        stage_histograms.observe(timer)
+
+    return response
+
+
 @app.middleware("http")
 async def db_session_middleware(request: Request, call_next):
     response = Response("Internal server error_message", status_code=500)
+    # the state has to exist before the scope is copied by the routing, `get_db` fills it in on demand
+    request.state.db = None
     try:
-        request.state.db = SessionLocal()
-
         response = await call_next(request)
     finally:
-        request.state.db.close()
+        close_db(request)
 
     return response
 
 
+if TRAFFIC_CAPTURE_PATH:
+    # added last, so it wraps everything else and records the whole time spent on a request
+    app.add_middleware(TrafficCaptureMiddleware, path=TRAFFIC_CAPTURE_PATH)
+
+
 if __name__ == "__main__":
+    from DAL import db_models
+
+    init_db()
     sess: Session = SessionLocal()
 
     logging.info("About to create a user")
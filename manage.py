@@ -0,0 +1,53 @@
+import argparse
+import logging
+
+from BLL.layers_schemas import layers_schemas_cache
+from configs import SessionLocal, init_db, LAYERS_SCHEMAS_SNAPSHOT_PATH
+from DAL.architecture_repository import compact_architectures
+
+
+def init_db_command(args):
+    init_db()
+
+    db = SessionLocal()
+    try:
+        layers_schemas_cache.write_snapshot_file(args.layers_schemas_snapshot, db)
+    finally:
+        db.close()
+
+    logging.info("Database initialized, layers schemas snapshot written to %s", args.layers_schemas_snapshot)
+
+
+def compact_architectures_command(args):
+    db = SessionLocal()
+    try:
+        stats = compact_architectures(db, batch_size=args.batch_size)
+    finally:
+        db.close()
+
+    logging.info("Compacted %(compacted)d architectures (%(duplicates)d duplicates), "
+                 "%(bytes_before)d -> %(bytes_after)d bytes", stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="nnio maintenance commands")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    init = commands.add_parser('init-db',
+                               help="create the missing tables and write the layers schemas snapshot, run before "
+                                    "starting the server")
+    init.add_argument('--layers-schemas-snapshot', default=LAYERS_SCHEMAS_SNAPSHOT_PATH)
+    init.set_defaults(handler=init_db_command)
+
+    compact = commands.add_parser('compact-architectures',
+                                  help="hash and compress the shared architectures stored before deduplication")
+    compact.add_argument('--batch-size', type=int, default=500)
+    compact.set_defaults(handler=compact_architectures_command)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,12 @@
-import enum
-from collections import deque, OrderedDict
+from array import array
+from collections import deque
 from datetime import datetime
-from typing import List, Dict, Iterable
+from enum import Enum
+from typing import List, Dict, Iterable, Tuple
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from pydantic.datetime_parse import parse_datetime
 
-from DAL import db_models
-from configs import SessionLocal
+from BLL.layers_schemas import layers_schemas_cache
 
 indents = {
     'tabs': "\t",
@@ -25,21 +25,37 @@ class FrameworkError(Exception):
     pass
 
 
-def load_layers():
-    sess: Session = SessionLocal()
-    try:
-        layers = [schema.layer_type for schema in sess.query(db_models.LayerSchema)]
-        return layers
-    finally:
-        sess.close()
+class LayerTypes(str):
+    """
+    Name of a layer type that has a schema. Only types surely unknown to the loaded layers schemas are rejected
+    while parsing, the rest is up to the schemas check of the endpoint, which follows the current schemas version,
+    so newly saved layer types are accepted by every worker without restarting it.
+    """
 
+    @property
+    def name(self):
+        return str(self)
 
-class EnumStr(str, enum.Enum):
-    pass
+    @property
+    def value(self):
+        return str(self)
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, v):
+        if not isinstance(v, str):
+            raise TypeError('string required')
+
+        if layers_schemas_cache.is_unknown_layer_type(v):
+            raise ValueError(f'unknown layer type "{v}"')
+
+        return cls(v)
 
 
-known_layers = load_layers()
-LayerTypes = EnumStr('LayerTypes', zip(known_layers, known_layers))
+LayerTypes.Input = LayerTypes('Input')
 
 
 class LayerBase(BaseModel):
@@ -52,42 +68,130 @@ class LayerData(LayerBase):
     inputs: List[str]
 
 
-class Layer(LayerBase):
-    inputs: List['Layer'] = []
-    outputs: List['Layer'] = []
+class ModelBase(BaseModel):
+    name: str
 
-    @staticmethod
-    def from_layer_data_empty(layer_data: LayerData):
-        layer_attrs = layer_data.dict()
-        layer_attrs['inputs'] = []
-        layer_attrs['outputs'] = []
 
-        return Layer(**layer_attrs)
+class ArchitectureDataModel(ModelBase):
+    date_created: datetime
+    id: str
+    layers: List[LayerData]
+
+    @classmethod
+    def validate(cls, value):
+        # request bodies are turned into models by this
+        if isinstance(value, dict):
+            return parse_architecture(value)
+
+        return super().validate(value)
+
+
+def parse_architecture(data: dict) -> ArchitectureDataModel:
+    """
+    Same as `ArchitectureDataModel(**data)` for parsed JSON, in a single pass and without copying the layers:
+    their `params` and `inputs` are used as they were parsed. Anything that would need a coercion or be reported
+    as an error is left to pydantic.
+    """
+    if not isinstance(data, dict):
+        return ArchitectureDataModel(**data)
+
+    name, id, layers_data = data.get('name'), data.get('id'), data.get('layers')
+    if type(name) is not str or type(id) is not str or type(layers_data) is not list or 'date_created' not in data:
+        return ArchitectureDataModel(**data)
+
+    try:
+        date_created = parse_datetime(data['date_created'])
+    except (TypeError, ValueError):
+        return ArchitectureDataModel(**data)
+
+    is_unknown_layer_type = layers_schemas_cache.is_unknown_layer_type
+    layers = []
+    for l in layers_data:
+        if type(l) is not dict:
+            return ArchitectureDataModel(**data)
+
+        layer_name, layer_type, params, inputs = l.get('name'), l.get('type'), l.get('params'), l.get('inputs')
+        if type(layer_name) is not str or type(layer_type) is not str or type(params) is not dict or \
+                type(inputs) is not list or not all(type(i) is str for i in inputs) or \
+                is_unknown_layer_type(layer_type):
+            return ArchitectureDataModel(**data)
+
+        values = dict(name=layer_name, type=LayerTypes(layer_type), params=params, inputs=inputs)
+        layers.append(LayerData.construct(values, set(values)))
+
+    values = dict(name=name, date_created=date_created, id=id, layers=layers)
+
+    return ArchitectureDataModel.construct(values, set(values))
+
+
+class PatchOperations(str, Enum):
+    add = 'add'
+    remove = 'remove'
+    modify = 'modify'
+
+
+class LayerPatchOperation(BaseModel):
+    """
+    `name` is the name of the layer to remove or modify, `layer` is the added layer or the new version
+    of the modified one (it may be renamed).
+    """
+    op: PatchOperations
+    name: str = None
+    layer: LayerData = None
+
+
+class ArchitecturePatch(BaseModel):
+    base_hash: str
+    # the name of the base architecture is kept without it
+    name: str = None
+    operations: List[LayerPatchOperation]
+
+
+class LayerNode:
+    __slots__ = ('id', 'name', 'type', 'params')
+
+    def __init__(self, id: int, name: str, type: LayerTypes, params: dict):
+        self.id = id
+        self.name = name
+        self.type = type
+        self.params = params
 
     def __repr__(self):
         return f"{self.name}({self.type})"
 
 
-Layer.update_forward_refs()
+class NetworkModel:
+    """
+    Linked architecture graph. Layers are addressed by their integer ids (positions in `layers`),
+    inputs and outputs are kept in CSR-style adjacency arrays:
+    inputs of layer `i` are `inputs_ids[inputs_offsets[i]:inputs_offsets[i + 1]]`, the same goes for outputs.
+    """
+    __slots__ = ('name', 'layers', 'ids', 'inputs_offsets', 'inputs_ids', 'outputs_offsets', 'outputs_ids')
 
+    def __init__(self, layers: List[LayerNode], inputs_offsets: array, inputs_ids: array,
+                 outputs_offsets: array, outputs_ids: array, name: str = "Model"):
+        self.name = name
+        self.layers = layers
+        self.ids: Dict[str, int] = {l.name: l.id for l in layers}
+        self.inputs_offsets = inputs_offsets
+        self.inputs_ids = inputs_ids
+        self.outputs_offsets = outputs_offsets
+        self.outputs_ids = outputs_ids
 
-class ModelBase(BaseModel):
-    name: str
-
+    def __len__(self):
+        return len(self.layers)
 
-class ArchitectureDataModel(ModelBase):
-    date_created: datetime
-    id: str
-    layers: List[LayerData]
+    def inputs(self, layer_id: int) -> array:
+        return self.inputs_ids[self.inputs_offsets[layer_id]:self.inputs_offsets[layer_id + 1]]
 
+    def outputs(self, layer_id: int) -> array:
+        return self.outputs_ids[self.outputs_offsets[layer_id]:self.outputs_offsets[layer_id + 1]]
 
-class NetworkModel(ModelBase):
-    layers: List[Layer]
+    def in_degree(self, layer_id: int) -> int:
+        return self.inputs_offsets[layer_id + 1] - self.inputs_offsets[layer_id]
 
-    def __init__(self, layers: List[Layer], name: str = "Model", **kwargs):
-        kwargs['layers'] = layers
-        kwargs['name'] = name
-        super().__init__(**kwargs)
+    def out_degree(self, layer_id: int) -> int:
+        return self.outputs_offsets[layer_id + 1] - self.outputs_offsets[layer_id]
 
     @staticmethod
     def from_data_model(data_model: ArchitectureDataModel):
@@ -95,47 +199,71 @@ class NetworkModel(ModelBase):
 
     @staticmethod
     def from_data_layers(layers_data: List[LayerData], name: str = "Model"):
-        linked_layers = NetworkModel._link_layers(layers_data)
-
-        return NetworkModel(name=name, layers=linked_layers)
+        return NetworkModel(*NetworkModel._link_layers(layers_data), name=name)
 
     @staticmethod
     def _link_layers(layers: Iterable[LayerData]) \
-            -> List[Layer]:
+            -> Tuple[List[LayerNode], array, array, array, array]:
 
         output_layers: List[LayerData] = NetworkModel._find_outputs_layers(layers)
-        layer_names = map(lambda x: x.name, layers)
-        layers_data_lookup = dict(zip(layer_names, layers))
-        existing_layers_lookup: Dict[str, Layer] = OrderedDict()
+        layers_data_lookup = {l.name: l for l in layers}
+        # layers are numbered in the order they are reached from the outputs, edges are kept in the same order
+        linked_layers: List[LayerData] = []
+        linked_ids: Dict[str, int] = {}
+        edges_from = array('i')
+        edges_to = array('i')
         layers_left = deque(output_layers)
         try:
             while layers_left:
                 layer_data = layers_left.popleft()
-                if layer_data.name not in existing_layers_lookup:
-                    l = Layer.from_layer_data_empty(layer_data)
-                    existing_layers_lookup[l.name] = l
-                else:
-                    l = existing_layers_lookup[layer_data.name]
-
-                inputs = (layers_data_lookup[name] for name in layer_data.inputs)
-
-                for i in inputs:
-                    if i.name not in existing_layers_lookup:
-                        li = Layer.from_layer_data_empty(i)
-                        existing_layers_lookup[li.name] = li
+                l = linked_ids.get(layer_data.name)
+                if l is None:
+                    l = linked_ids[layer_data.name] = len(linked_layers)
+                    linked_layers.append(layer_data)
+
+                for name in layer_data.inputs:
+                    li = linked_ids.get(name)
+                    if li is None:
+                        i = layers_data_lookup[name]
+                        li = linked_ids[name] = len(linked_layers)
+                        linked_layers.append(i)
                         layers_left.append(i)
-                    else:
-                        li = existing_layers_lookup[i.name]
 
-                    li.outputs.append(l)
-                    l.inputs.append(li)
+                    edges_from.append(li)
+                    edges_to.append(l)
         except KeyError as e:
             raise ValueError(f'Layer with name "{e.args[0]} does not exist, but is being referenced in the model."')
 
-        return list(existing_layers_lookup.values())[::-1]
+        # ids are assigned in the reversed order, so that inputs come before the layers using them
+        last_id = len(linked_layers) - 1
+        layers_nodes = [LayerNode(n, l.name, l.type, l.params) for n, l in enumerate(reversed(linked_layers))]
+        edges_from = array('i', (last_id - n for n in edges_from))
+        edges_to = array('i', (last_id - n for n in edges_to))
+
+        inputs_offsets, inputs_ids = NetworkModel._to_csr(edges_to, edges_from, len(layers_nodes))
+        outputs_offsets, outputs_ids = NetworkModel._to_csr(edges_from, edges_to, len(layers_nodes))
+
+        return layers_nodes, inputs_offsets, inputs_ids, outputs_offsets, outputs_ids
+
+    @staticmethod
+    def _to_csr(keys: array, values: array, size: int) -> Tuple[array, array]:
+        # stable counting sort of `values` by `keys`: values of each key keep their edges order
+        offsets = array('i', bytes(array('i').itemsize * (size + 1)))
+        for k in keys:
+            offsets[k + 1] += 1
+        for k in range(size):
+            offsets[k + 1] += offsets[k]
+
+        positions = array('i', offsets)
+        res = array('i', bytes(array('i').itemsize * len(values)))
+        for k, v in zip(keys, values):
+            res[positions[k]] = v
+            positions[k] += 1
+
+        return offsets, res
 
     @staticmethod
-    def _find_outputs_layers(layers: Iterable[LayerBase]):
+    def _find_outputs_layers(layers: Iterable[LayerData]):
         input_names = set()
         for l in layers:
             input_names.update(l.inputs)
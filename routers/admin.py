@@ -1,13 +1,24 @@
 import json
+import logging
 
 from sqlalchemy.orm import Session
 from starlette.requests import Request
 from fastapi import Depends, APIRouter
 from starlette.responses import Response
 
-from DAL import db_models
-from routers.common import oauth2_scheme, templates
-from routers.users import get_db
+from BLL.architecture_sharing import loaded_architectures_cache
+from BLL.exporting.code_writer import stream_producers
+from BLL.exporting.export_cache import export_cache
+from BLL.exporting.export_pool import export_pool
+from BLL.exporting.incremental_export import architecture_graphs
+from BLL.layers_schemas import layers_schemas_cache
+from BLL.password_hashing import password_hashing
+from BLL.stage_timing import stage_histograms
+from configs import LAYERS_SCHEMAS_SNAPSHOT_PATH
+from DAL import layers_schemas_repository
+from DAL.pool_metrics import pool_metrics
+from routers.common import oauth2_scheme, templates, etag_matches, db_sessions_stats
+from routers.users import get_db, verified_tokens_cache, users_cache
 
 router = APIRouter()
 
@@ -18,25 +29,49 @@ def get_admin_page(request: Request):
 
 
 @router.get("/layers_schemas")
-def get_layers_schemas(db: Session = Depends(get_db)):
-    layer_schemas_strs = []
-    # concatenating JSON representationsF from db (they are already serialized strings)
-    for schema in db.query(db_models.LayerSchema):
-        layer_schemas_strs.append('"{}": {}'.format(schema.layer_type, schema.layer_schema))
+def get_layers_schemas(request: Request, db: Session = Depends(get_db)):
+    schemas = layers_schemas_cache.get(db)
+    headers = {'ETag': schemas.etag}
 
-    res_str = ",".join(layer_schemas_strs)
-    res_str = "{" + res_str + "}"
+    if etag_matches(request, schemas.etag):
+        return Response(status_code=304, headers=headers)
 
-    return Response(content=res_str, media_type='application/json')
+    return Response(content=schemas.body, media_type='application/json', headers=headers)
 
 
 @router.post("/save_layers_schemas")
-def post_save_layers_schemas(body: dict, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    db.query(db_models.LayerSchema).delete()
-
-    for layer_type, layer_schema in body.items():
-        db.add(db_models.LayerSchema(
-            # such separators -> minified JSON (no spaces and no indents)
-            layer_type=layer_type, layer_schema=json.dumps(layer_schema, separators=(',', ':'))
-        ))
-    db.commit()
+def post_save_layers_schemas(request: Request, body: dict, token: str = Depends(oauth2_scheme)):
+    db = get_db(request)
+    layers_schemas_repository.replace_layers_schemas(db, {
+        # such separators -> minified JSON (no spaces and no indents)
+        layer_type: json.dumps(layer_schema, separators=(',', ':'))
+        for layer_type, layer_schema in body.items()
+    })
+    layers_schemas_cache.invalidate()
+
+    try:
+        layers_schemas_cache.write_snapshot_file(LAYERS_SCHEMAS_SNAPSHOT_PATH, db)
+    except OSError:
+        # only makes the next boot a bit slower
+        logging.warning("Could not write the layers schemas snapshot", exc_info=True)
+
+
+@router.get("/metrics")
+def get_metrics(token: str = Depends(oauth2_scheme)):
+    return dict(
+        export_cache=export_cache.stats(),
+        db_sessions=db_sessions_stats.stats(),
+        db_pool=pool_metrics.stats(),
+        export_pool=export_pool.stats(),
+        stream_producers=stream_producers.stats(),
+        architecture_graphs=architecture_graphs.stats(),
+        loaded_architectures_cache=loaded_architectures_cache.stats(),
+        verified_tokens_cache=verified_tokens_cache.stats(),
+        users_cache=users_cache.stats(),
+        password_hashing=password_hashing.stats(),
+    )
+
+
+@router.get("/metrics/prometheus")
+def get_prometheus_metrics(token: str = Depends(oauth2_scheme)):
+    return Response(content=stage_histograms.prometheus_text(), media_type='text/plain; version=0.0.4')
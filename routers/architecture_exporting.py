@@ -1,21 +1,37 @@
+import asyncio
 import json
 import logging
 import enum
+import re
+import time
+from array import array
 from collections import deque
-from copy import copy, deepcopy
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from json import JSONDecodeError
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import starlette.status as status
-from sqlalchemy.orm import Session
-from starlette.responses import PlainTextResponse
-from fastapi import HTTPException, File, APIRouter, Query, Depends
-from jsonschema import validate
-from jsonschema.exceptions import ValidationError as JsonSchemaValidationError
-from pydantic import ValidationError as PydanticValidataionError
-
-from BLL.exporting.model_exporting import KNOWN_FRAMEWORKS, export_model
-from models import ArchitectureDataModel, NetworkModel, line_breaks, indents, FrameworkError, LayerTypes, Layer
-from routers.admin import get_layers_schemas
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, StreamingResponse
+from fastapi import HTTPException, File, APIRouter, Query, UploadFile
+from pydantic import BaseModel, ValidationError as PydanticValidataionError
+
+from BLL.exporting.archive import iter_zip
+from BLL.exporting.code_writer import StreamProducersFull
+from BLL.exporting.export_cache import export_cache, export_cache_key, architecture_hash, layers_hash
+from BLL.exporting.export_pool import export_pool, ExportPoolFull
+from BLL.exporting.graph_analysis import GraphAnalysis
+from BLL.exporting.incremental_export import ArchitectureGraph, architecture_graphs, apply_patch, patched_net_model
+from BLL.exporting.model_exporting import KNOWN_FRAMEWORKS, export_model, iter_export_model
+from BLL.exporting.shape_inference import estimate_model
+from BLL.layers_schemas import layers_schemas_cache, LayersSchemasSnapshot
+from BLL.stage_timing import stage, current_timer, start_timer, stop_timer, record_since_start, label_export
+from BLL.validation import LayerValidatorsRegistry
+from configs import MAX_MODEL_PARAMS, MAX_MODEL_FLOPS
+from models import ArchitectureDataModel, ArchitecturePatch, NetworkModel, LayerData, line_breaks, indents, \
+    FrameworkError, LayerTypes, parse_architecture
 from routers.common import get_db
 
 router = APIRouter()
@@ -24,35 +40,58 @@ Frameworks = enum.Enum('Frameworks', zip(KNOWN_FRAMEWORKS, KNOWN_FRAMEWORKS))
 LineBreaks = enum.Enum('LineBreaks', zip(line_breaks.keys(), line_breaks.keys()))
 Indents = enum.Enum('Indents', zip(indents.keys(), indents.keys()))
 
+ARCHIVE_FILENAME_PATTERN = re.compile(r'^[\w-][\w.-]*$')
+
+
+class ExportTarget(BaseModel):
+    framework: Frameworks
+    line_break: LineBreaks = LineBreaks.lf
+    indent: Indents = Indents.spaces_4
+    keras_prefer_sequential: bool = False
+    estimate_header: bool = False
+    # name of the file in the archive
+    filename: str = None
+
 
 @router.post("/export-from-json-file")
-async def export_from_json_file(framework: Frameworks,
+async def export_from_json_file(request: Request,
+                                framework: Frameworks,
                                 architecture_file: bytes = File(..., alias='architecture-file'),
                                 line_break: LineBreaks = LineBreaks.lf,
                                 indent: Indents = Indents.spaces_4,
                                 keras_prefer_sequential: bool = False,
-                                db: Session = Depends(get_db)):
+                                collect_all_errors: bool = False,
+                                estimate_header: bool = False):
     """
     Example request file: https://jsoneditoronline.org/?id=24ce7b7c485c42f7bec3c27a4f437afd
     """
     # by using `bytes` the FastAPI will read the file and give me its content in `bytes`
     try:
-        architecture_dict = json.loads(architecture_file)
-        model = ArchitectureDataModel(**architecture_dict)
+        model = parse_architecture(json.loads(architecture_file))
     except (PydanticValidataionError, JSONDecodeError) as e:
         raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, "Invalid architecture file:\n{}".format(e))
 
-    return await export_from_json_body(framework, model, line_break, indent,
-                                       keras_prefer_sequential=keras_prefer_sequential, db=db)
+    return await export_from_json_body(request, framework, model, line_break, indent,
+                                       keras_prefer_sequential=keras_prefer_sequential,
+                                       collect_all_errors=collect_all_errors, estimate_header=estimate_header)
 
 
 @router.post("/export-from-json-body")
-async def export_from_json_body(framework: Frameworks,
+async def export_from_json_body(request: Request,
+                                framework: Frameworks,
                                 model: ArchitectureDataModel,
                                 line_break: LineBreaks = LineBreaks.lf,
                                 indent: Indents = Indents.spaces_4,
                                 keras_prefer_sequential: bool = False,
-                                db: Session = Depends(get_db)):
+                                collect_all_errors: bool = False,
+                                stream: bool = False,
+                                estimate_header: bool = False):
+    """
+    With `stream` the code is sent to the client in chunks while being generated.
+    With `estimate_header` the code starts with a comment with the estimated model size (see `/estimate`).
+    The `X-Architecture-Hash` response header is the base hash for `/export-from-patch`.
+    """
+    record_since_start('parse')
     framework = framework.value.lower()
 
     line_break = line_break.value.lower()
@@ -63,38 +102,472 @@ async def export_from_json_body(framework: Frameworks,
     logging.info(model.id)
     logging.info(model.date_created)
 
-    layer_schemas = json.loads(get_layers_schemas(db).body)
-    validate_model(model, layer_schemas)
+    framework_specific_params = dict(
+        keras_prefer_sequential=keras_prefer_sequential,
+        estimate_header=estimate_header,
+    )
+
+    with stage('schemas'):
+        layers_schemas = layers_schemas_cache.get(get_db(request))
+    with stage('cache'):
+        arch_hash = architecture_hash(model)
+    headers = {'X-Architecture-Hash': arch_hash}
+    if not stream:
+        source_code = await export_architecture_async(model, framework, line_break, indent, layers_schemas,
+                                                      collect_all=collect_all_errors, arch_hash=arch_hash,
+                                                      **framework_specific_params)
+        register_architecture_graph(arch_hash, model, layers_schemas)
+        return PlainTextResponse(source_code, headers=headers)
+
+    label_export(framework, len(model.layers))
+    cache_key, source_code = get_cached_export(model, framework, line_break, indent, layers_schemas,
+                                               arch_hash=arch_hash, **framework_specific_params)
+    if source_code is not None:
+        register_architecture_graph(arch_hash, model, layers_schemas)
+        return PlainTextResponse(source_code, headers=headers)
+
+    # validation errors still have to be reported with a proper status code, so nothing is streamed before it;
+    # streamed exports are generated in this process, the chunks can't be passed from the export pool cheaply,
+    # but large models are still validated and linked off the event loop
+    if len(model.layers) >= export_pool.min_layers:
+        net_model = await run_in_threadpool(link_architecture, model, layers_schemas.validators,
+                                            collect_all=collect_all_errors)
+    else:
+        net_model = link_architecture(model, layers_schemas.validators, collect_all=collect_all_errors)
+    register_architecture_graph(arch_hash, model, layers_schemas, net_model)
+    with export_pool_errors():
+        chunks = iter_export_model(net_model, framework, line_breaks[line_break], indents[indent],
+                                   **framework_specific_params)
+
+    return StreamingResponse(tee_to_export_cache(chunks, cache_key), media_type='text/plain', headers=headers)
+
+
+@router.post("/export-archive")
+def export_archive(request: Request,
+                   architecture: ArchitectureDataModel,
+                   targets: List[ExportTarget],
+                   collect_all_errors: bool = False):
+    """
+    Exports the architecture for every target into one zip archive, streamed while being built:
+    `{"architecture": {...}, "targets": [{"framework": "keras", "indent": "tabs", "filename": "model.py"}, ...]}`
+    (target fields are the query parameters of `/export-from-json-body`, all but the framework are optional).
+    The architecture is validated and linked once for all targets. A target failing to export gets
+    a `<filename>.error.txt` file with the error instead.
+    """
+    record_since_start('parse')
+    model = architecture
+    if not targets:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, "At least one export target is required.")
+
+    with stage('schemas'):
+        layers_schemas = layers_schemas_cache.get(get_db(request))
+
+    frameworks = sorted({t.framework.value.lower() for t in targets})
+    label_export(",".join(frameworks), len(model.layers))
+    exports = []
+    filenames = set()
+    with stage('cache'):
+        arch_hash = architecture_hash(model)
+        for t in targets:
+            framework = t.framework.value.lower()
+            line_break = t.line_break.value.lower()
+            indent = t.indent.value.lower()
+            framework_specific_params = dict(
+                keras_prefer_sequential=t.keras_prefer_sequential,
+                estimate_header=t.estimate_header,
+            )
+
+            filename = t.filename
+            if filename is None:
+                filename = "_".join([framework, line_break, indent])
+                if t.keras_prefer_sequential:
+                    filename += "_sequential"
+                filename += ".py"
+            if not ARCHIVE_FILENAME_PATTERN.match(filename) or filename in filenames:
+                raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                    f"Invalid or duplicate file name {filename}, "
+                                    f"targets with the same options need different file names.")
+            filenames.add(filename)
+
+            cache_key = export_cache_key(arch_hash, framework, line_break, indent, layers_schemas.version,
+                                         **framework_specific_params)
+            exports.append((filename, framework, line_break, indent, framework_specific_params, cache_key,
+                            export_cache.get(cache_key)))
+
+    net_model = analysis = None
+    if any(source_code is None for *_, source_code in exports):
+        # errors of the architecture itself are still reported with a proper status code
+        net_model = link_architecture(model, layers_schemas.validators, collect_all=collect_all_errors)
+        analysis = GraphAnalysis(net_model)
+    register_architecture_graph(arch_hash, model, layers_schemas, net_model)
+
+    def archive_files() -> Iterator[Tuple[str, Iterable[str]]]:
+        for filename, framework, line_break, indent, framework_specific_params, cache_key, source_code in exports:
+            if source_code is not None:
+                yield filename, [source_code]
+                continue
+
+            # generated right here, in the thread iterating over the archive: a writer thread per file would add
+            # nothing but a thread, the code of the file is kept for the export cache anyway
+            try:
+                source_code = export_model(net_model, framework, line_breaks[line_break], indents[indent],
+                                           analysis=analysis, **framework_specific_params)
+            except FrameworkError as e:
+                yield filename + ".error.txt", [str(e)]
+                continue
+
+            export_cache.put(cache_key, source_code)
+            yield filename, [source_code]
+
+    archive_name = re.sub(r'[^\w.-]+', '_', model.name).strip('._') or 'architecture'
+    headers = {
+        'X-Architecture-Hash': arch_hash,
+        'Content-Disposition': f'attachment; filename="{archive_name}.zip"',
+    }
+
+    return StreamingResponse(iter_zip(archive_files()), media_type='application/zip', headers=headers)
+
+
+def tee_to_export_cache(chunks: Iterable[str], cache_key: str) -> Iterator[str]:
+    streamed_chunks = []
+    for chunk in chunks:
+        streamed_chunks.append(chunk)
+        yield chunk
+
+    export_cache.put(cache_key, "".join(streamed_chunks))
+
+
+@router.post("/export-from-patch")
+def export_from_patch(request: Request,
+                      framework: Frameworks,
+                      patch: ArchitecturePatch,
+                      line_break: LineBreaks = LineBreaks.lf,
+                      indent: Indents = Indents.spaces_4,
+                      keras_prefer_sequential: bool = False,
+                      collect_all_errors: bool = False,
+                      estimate_header: bool = False):
+    """
+    Exports a new version of an architecture exported before (`base_hash` is its `X-Architecture-Hash`)
+    given as layer operations: `{"op": "add", "layer": {...}}`, `{"op": "remove", "name": ...}`
+    or `{"op": "modify", "name": ..., "layer": {...}}`. The code is the same as the full export of the patched
+    architecture would give, its hash is in the `X-Architecture-Hash` header again.
+    """
+    record_since_start('parse')
+    framework = framework.value.lower()
+    line_break = line_break.value.lower()
+    indent = indent.value.lower()
+    framework_specific_params = dict(
+        keras_prefer_sequential=keras_prefer_sequential,
+        estimate_header=estimate_header,
+    )
+
+    graph = architecture_graphs.get(patch.base_hash)
+    if graph is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND,
+                            "Unknown base architecture, it has to be exported in full first.")
+
+    with stage('schemas'):
+        layers_schemas = layers_schemas_cache.get(get_db(request))
+    with stage('patch'):
+        try:
+            name, layers, touched, structural = apply_patch(graph, patch.operations, patch.name)
+        except ValueError as e:
+            raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, "Invalid patch: " + e.args[0])
+
+    label_export(framework, len(layers))
+    with stage('cache'):
+        arch_hash = layers_hash(name, layers)
+        cache_key = export_cache_key(arch_hash, framework, line_break, indent, layers_schemas.version,
+                                     **framework_specific_params)
+        source_code = export_cache.get(cache_key)
+    headers = {'X-Architecture-Hash': arch_hash}
+    if source_code is not None:
+        if architecture_graphs.get(arch_hash) is None:
+            architecture_graphs.put(arch_hash, ArchitectureGraph(name, layers, layers_schemas.version))
+        return PlainTextResponse(source_code, headers=headers)
+
+    with stage('validate'):
+        # the layers left as they were have been validated against the same schemas already
+        layers_to_validate = touched if graph.schemas_version == layers_schemas.version else None
+        validate_layers(layers, layers_schemas.validators, collect_all_errors, layers_to_validate)
+    if structural or graph.net_model is None:
+        net_model = link_layers(layers, name)
+    else:
+        net_model = patched_net_model(graph, name, touched)
+    check_size_budget(net_model)
+
+    # shared by all versions of the architecture, only the calls of new or modified layers get rendered
+    if graph.rendered_calls is None:
+        graph.rendered_calls = {}
     try:
-        net_model = NetworkModel.from_data_model(model)
+        source_code = export_model(net_model, framework, line_breaks[line_break], indents[indent],
+                                   rendered_calls=graph.rendered_calls, **framework_specific_params)
+    except FrameworkError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+
+    architecture_graphs.put(arch_hash, ArchitectureGraph(name, layers, layers_schemas.version, net_model,
+                                                         graph.rendered_calls))
+    export_cache.put(cache_key, source_code)
+
+    return PlainTextResponse(source_code, headers=headers)
+
+
+def register_architecture_graph(arch_hash: str, model: ArchitectureDataModel, layers_schemas: LayersSchemasSnapshot,
+                                net_model: NetworkModel = None):
+    # a graph exported before keeps its linked layers and rendered calls
+    if architecture_graphs.get(arch_hash) is None:
+        architecture_graphs.put(arch_hash, ArchitectureGraph(model.name, model.layers, layers_schemas.version,
+                                                             net_model))
+
+
+@router.post("/estimate")
+def estimate(request: Request,
+             model: ArchitectureDataModel,
+             include_layers: bool = True,
+             collect_all_errors: bool = False):
+    """
+    Output shape (without the batch dimension), parameters, FLOPs and activation memory (float32, per sample)
+    of every layer, in a topological order, and of the whole model. Layers of unsupported types and those depending
+    on them are listed in `not_estimated` and left out of the totals.
+    """
+    record_since_start('parse')
+    with stage('schemas'):
+        layers_schemas = layers_schemas_cache.get(get_db(request))
+    # the size budget is not checked, this is how to find out the size of a model over it
+    net_model = link_architecture(model, layers_schemas.validators, collect_all=collect_all_errors,
+                                  check_budget=False)
+    with stage('estimate'):
+        return estimate_model(net_model).to_dict(include_layers)
+
+
+@router.post("/export-batch-from-jsonl-file")
+def export_batch_from_jsonl_file(request: Request,
+                                 framework: Frameworks,
+                                 architectures_file: UploadFile = File(..., alias='architectures-file'),
+                                 line_break: LineBreaks = LineBreaks.lf,
+                                 indent: Indents = Indents.spaces_4,
+                                 keras_prefer_sequential: bool = False,
+                                 collect_all_errors: bool = False,
+                                 estimate_header: bool = False):
+    """
+    Exports every architecture of a JSON Lines file (one architecture per line).
+    Results are streamed back as NDJSON, one line per architecture as soon as it is exported:
+    `{"index": ..., "id": ..., "source": ..., "error": ..., "time_ms": ...}`
+    """
+    framework = framework.value.lower()
+    line_break = line_break.value.lower()
+    indent = indent.value.lower()
+
+    # loaded once for the whole batch, before the response (and the DB session) is gone
+    layers_schemas = layers_schemas_cache.get(get_db(request))
+
+    def export_lines():
+        index = 0
+        for line in architectures_file.file:
+            if not line.strip():
+                continue
+
+            start = time.perf_counter()
+            result = dict(index=index, id=None, source=None, error=None)
+            try:
+                architecture_dict = json.loads(line)
+                result['id'] = architecture_dict.get('id') if isinstance(architecture_dict, dict) else None
+                model = parse_architecture(architecture_dict)
+                result['source'] = export_architecture(model, framework, line_break, indent, layers_schemas,
+                                                       collect_all=collect_all_errors,
+                                                       keras_prefer_sequential=keras_prefer_sequential,
+                                                       estimate_header=estimate_header)
+            except HTTPException as e:
+                result['error'] = e.detail
+            except (PydanticValidataionError, JSONDecodeError, TypeError) as e:
+                result['error'] = "Invalid architecture:\n{}".format(e)
+            except Exception:
+                logging.exception("Batch export of architecture #%d failed", index)
+                result['error'] = "Internal server error"
+
+            result['time_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            index += 1
+
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(export_lines(), media_type='application/x-ndjson')
+
+
+def export_architecture(model: ArchitectureDataModel, framework: str, line_break: str, indent: str,
+                        layers_schemas: LayersSchemasSnapshot, collect_all: bool = False, arch_hash: str = None,
+                        **framework_specific_params) -> str:
+    label_export(framework, len(model.layers))
+    cache_key, source_code = get_cached_export(model, framework, line_break, indent, layers_schemas,
+                                               arch_hash=arch_hash, **framework_specific_params)
+    if source_code is not None:
+        return source_code
+
+    if export_pool.should_offload(len(model.layers)):
+        collect_timings = current_timer() is not None
+        with export_pool_errors(), stage('offload'):
+            result = export_pool.run(run_export_job, model, framework, line_break, indent, layers_schemas.version,
+                                     layers_schemas.schemas, collect_all, framework_specific_params, collect_timings)
+        source_code = add_job_timings(result)
+    else:
+        source_code = generate_code(model, framework, line_break, indent, layers_schemas.validators, collect_all,
+                                    **framework_specific_params)
+
+    export_cache.put(cache_key, source_code)
+
+    return source_code
+
+
+async def export_architecture_async(model: ArchitectureDataModel, framework: str, line_break: str, indent: str,
+                                    layers_schemas: LayersSchemasSnapshot, collect_all: bool = False,
+                                    arch_hash: str = None, **framework_specific_params) -> str:
+    if not export_pool.should_offload(len(model.layers)):
+        return export_architecture(model, framework, line_break, indent, layers_schemas, collect_all, arch_hash,
+                                   **framework_specific_params)
+
+    label_export(framework, len(model.layers))
+    cache_key, source_code = get_cached_export(model, framework, line_break, indent, layers_schemas,
+                                               arch_hash=arch_hash, **framework_specific_params)
+    if source_code is not None:
+        return source_code
+
+    collect_timings = current_timer() is not None
+    with export_pool_errors(), stage('offload'):
+        result = await export_pool.run_async(run_export_job, model, framework, line_break, indent,
+                                             layers_schemas.version, layers_schemas.schemas, collect_all,
+                                             framework_specific_params, collect_timings)
+    source_code = add_job_timings(result)
+
+    export_cache.put(cache_key, source_code)
+
+    return source_code
+
+
+def get_cached_export(model: ArchitectureDataModel, framework: str, line_break: str, indent: str,
+                      layers_schemas: LayersSchemasSnapshot, arch_hash: str = None,
+                      **framework_specific_params) -> Tuple[str, Optional[str]]:
+    with stage('cache'):
+        if arch_hash is None:
+            arch_hash = architecture_hash(model)
+        cache_key = export_cache_key(arch_hash, framework, line_break, indent, layers_schemas.version,
+                                     **framework_specific_params)
+        return cache_key, export_cache.get(cache_key)
+
+
+@contextmanager
+def export_pool_errors():
+    try:
+        yield
+    except (ExportPoolFull, StreamProducersFull):
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Too many exports in progress, try again later.")
+    except (asyncio.TimeoutError, FutureTimeoutError):
+        raise HTTPException(status.HTTP_504_GATEWAY_TIMEOUT, "Export took too long.")
+
+
+# validators of the export pool processes, compiled once per layers schemas version
+_job_validators = LayerValidatorsRegistry()
+
+
+def run_export_job(model: ArchitectureDataModel, framework: str, line_break: str, indent: str,
+                   layers_schemas_version: int, layers_schemas: Dict[str, dict], collect_all: bool,
+                   framework_specific_params: dict, collect_timings: bool = False) \
+        -> Tuple[str, Optional[Dict[str, float]]]:
+    """
+    Runs in an export pool process: everything comes in pickled, no DB access.
+    Returns the code and, with `collect_timings`, the time spent in every stage.
+    """
+    token = start_timer() if collect_timings else None
+    try:
+        with stage('schemas'):
+            _job_validators.load(layers_schemas, source=layers_schemas_version)
+
+        source_code = generate_code(model, framework, line_break, indent, _job_validators, collect_all,
+                                    **framework_specific_params)
+    finally:
+        timer = stop_timer(token) if token is not None else None
+
+    return source_code, None if timer is None else timer.stages
+
+
+def add_job_timings(result: Tuple[str, Optional[Dict[str, float]]]) -> str:
+    source_code, stages = result
+    timer = current_timer()
+    if timer is not None and stages:
+        # these are included in `offload` as well
+        for name, seconds in stages.items():
+            timer.add(name, seconds)
+
+    return source_code
+
+
+def generate_code(model: ArchitectureDataModel, framework: str, line_break: str, indent: str,
+                  validators: LayerValidatorsRegistry, collect_all: bool = False, **framework_specific_params) -> str:
+    net_model = link_architecture(model, validators, collect_all=collect_all)
+    line_break_str = line_breaks[line_break]
+    indent_str = indents[indent]
+
+    try:
+        return export_model(net_model, framework, line_break_str, indent_str, **framework_specific_params)
+    except FrameworkError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+
+
+def link_architecture(model: ArchitectureDataModel, validators: LayerValidatorsRegistry,
+                      collect_all: bool = False, check_budget: bool = True) -> NetworkModel:
+    with stage('validate'):
+        validate_model(model, validators, collect_all=collect_all)
+
+    net_model = link_layers(model.layers, model.name)
+    if check_budget:
+        check_size_budget(net_model)
+
+    return net_model
+
+
+def check_size_budget(net_model: NetworkModel):
+    if not MAX_MODEL_PARAMS and not MAX_MODEL_FLOPS:
+        return
+
+    with stage('estimate'):
+        estimate = estimate_model(net_model)
+    if MAX_MODEL_PARAMS and estimate.params > MAX_MODEL_PARAMS:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            f"Model has {estimate.params:,} parameters, the limit is {MAX_MODEL_PARAMS:,}.")
+    if MAX_MODEL_FLOPS and estimate.flops > MAX_MODEL_FLOPS:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            f"Model takes {estimate.flops:,} FLOPs per sample, the limit is {MAX_MODEL_FLOPS:,}.")
+
+
+def link_layers(layers: List[LayerData], name: str) -> NetworkModel:
+    try:
+        with stage('link'):
+            net_model = NetworkModel.from_data_layers(layers, name)
     except ValueError as e:
         raise HTTPException(
             status.HTTP_422_UNPROCESSABLE_ENTITY,
             'Invalid model structure: ' + e.args[0],
         )
-    validate_is_acyclic(deepcopy(net_model))
-    line_break_str = line_breaks[line_break]
-    indent_str = indents[indent]
+    with stage('acyclic'):
+        validate_is_acyclic(net_model)
 
-    framework_specific_params = dict(
-        keras_prefer_sequential=keras_prefer_sequential
-    )
+    return net_model
 
-    try:
-        source_code = export_model(net_model, framework, line_break_str, indent_str, **framework_specific_params)
-        return PlainTextResponse(source_code)
-    except FrameworkError as e:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+
+def validate_model(model: ArchitectureDataModel, validators: LayerValidatorsRegistry, collect_all: bool = False):
+    validate_layers(model.layers, validators, collect_all)
 
 
-def validate_model(model: ArchitectureDataModel, layer_schemas):
-    if len(model.layers) < 1:
+def validate_layers(layers: List[LayerData], validators: LayerValidatorsRegistry, collect_all: bool = False,
+                    layers_to_validate: List[LayerData] = None):
+    """
+    Model-level checks take all `layers`, the schemas are checked for `layers_to_validate` only (all by default).
+    """
+    if len(layers) < 1:
         raise HTTPException(
             status.HTTP_422_UNPROCESSABLE_ENTITY,
             "Model must have at least 1 layer."
         )
 
-    input_layers = [l for l in model.layers if l.type == LayerTypes.Input]
+    input_layers = [l for l in layers if l.type == LayerTypes.Input]
 
     if len(input_layers) < 1:
         raise HTTPException(
@@ -104,16 +577,15 @@ def validate_model(model: ArchitectureDataModel, layer_schemas):
         )
 
     layers_schema_validation_errors = []
-    for l in model.layers:
-        try:
-            validate(l.dict(), layer_schemas[l.type.name])
-        except JsonSchemaValidationError as e:
-            layers_schema_validation_errors.append(str(e))
+    for l in layers if layers_to_validate is None else layers_to_validate:
+        # a view of the layer as it was sent, `l.dict()` would deep copy the params
+        layer = dict(name=l.name, type=l.type, params=l.params, inputs=l.inputs)
+        layers_schema_validation_errors.extend(validators.validate_layer(l.name, l.type.name, layer, collect_all))
 
     if len(layers_schema_validation_errors):
         raise HTTPException(
             status.HTTP_422_UNPROCESSABLE_ENTITY,
-            '\n'.join(layers_schema_validation_errors)
+            '\n'.join(map(str, layers_schema_validation_errors))
         )
 
 
@@ -124,43 +596,58 @@ def validate_member_in(member, collection, member_name):
 
 
 def validate_is_acyclic(net_model: NetworkModel):
-    # https://www.cs.hmc.edu/~keller/courses/cs60/s98/examples/acyclic/
-
-    leaf_nodes_left = deque()
-    num_leafs = 0
+    # Kahn's algorithm on in-degree counters - the model itself is neither copied nor modified
     if len(net_model.layers) == 0:
         # kind of workaround (model will have 0 layers if no output layers are found)
         raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Architecture contains a cycle.")
 
-    for l in net_model.layers:
-        if len(l.outputs) == 0:
-            leaf_nodes_left.append(l)
+    offsets = net_model.inputs_offsets
+    in_degrees = array('i', (offsets[i + 1] - offsets[i] for i in range(len(net_model))))
+    layers_left = deque(i for i, d in enumerate(in_degrees) if d == 0)
+    num_visited = 0
 
-    while len(leaf_nodes_left) != 0:
-        l: Layer = leaf_nodes_left.popleft()
-        num_leafs += 1
+    while layers_left:
+        l = layers_left.popleft()
+        num_visited += 1
+
+        for l_out in net_model.outputs(l):
+            in_degrees[l_out] -= 1
+            if in_degrees[l_out] == 0:
+                layers_left.append(l_out)
+
+    if num_visited != len(net_model.layers):
+        cycle = find_cycle(net_model, in_degrees)
+        raise HTTPException(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            f"Architecture contains a cycle: {' -> '.join(cycle + cycle[:1])}."
+        )
 
-        for l_adj in l.inputs:
-            # this is stupidly inefficient
-            l_adj.outputs = [l_adj_out for l_adj_out in l_adj.outputs if l_adj_out.name != l.name]
 
-            if len(l_adj.outputs) == 0:
-                leaf_nodes_left.append(l_adj)
+def find_cycle(net_model: NetworkModel, in_degrees: array) -> List[str]:
+    # every layer left unvisited by Kahn's algorithm has an unvisited input,
+    # so walking from one of them along such inputs has to end up in a cycle
+    l = next(i for i, d in enumerate(in_degrees) if d > 0)
+    path_positions: Dict[int, int] = {}
+    path = []
+    while l not in path_positions:
+        path_positions[l] = len(path)
+        path.append(l)
+        l = next(i for i in net_model.inputs(l) if in_degrees[i] > 0)
 
-    if num_leafs != len(net_model.layers):
-        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, f"Architecture contains a cycle.")
+    # the walk goes against the edges direction
+    return [net_model.layers[i].name for i in path[path_positions[l]:][::-1]]
 
 
 def model_to_string(model: NetworkModel):
     res = ""
     for l in model.layers:
-        if l.inputs:
-            res += ", ".join(i.name for i in l.inputs)
+        if model.in_degree(l.id):
+            res += ", ".join(model.layers[i].name for i in model.inputs(l.id))
             res += " -> "
         res += l.name
-        if l.outputs:
+        if model.out_degree(l.id):
             res += " -> "
-            res += ", ".join(o.name for o in l.outputs)
+            res += ", ".join(model.layers[o].name for o in model.outputs(l.id))
         res += '<br>'
 
     return res
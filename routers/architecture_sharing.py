@@ -5,30 +5,53 @@ import enum
 import starlette.status as status
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from starlette.responses import PlainTextResponse
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
 from fastapi import HTTPException, File, APIRouter, Query, Depends, Body
 from jsonschema import validate
 from jsonschema.exceptions import ValidationError as JsonSchemaValidationError
 from pydantic import ValidationError as PydanticValidataionError
 
+from BLL.architecture_sharing import loaded_architectures_cache, loaded_architecture
+from BLL.layers_schemas import layers_schemas_cache
 from BLL.exporting.model_exporting import KNOWN_FRAMEWORKS, export_model
-from DAL.architecture_repository import store_new_architecture, get_architecture_by_id
+from DAL.architecture_repository import store_architecture, get_architecture_data
 from models import ArchitectureDataModel, NetworkModel, line_breaks, indents, FrameworkError, LayerTypes
-from routers.admin import get_layers_schemas
-from routers.common import get_db
+from routers.common import get_db, etag_matches
 
 router = APIRouter()
 
 
 @router.post("/share")
-def share_architecture(model: ArchitectureDataModel,
-                       db: Session = Depends(get_db)):
-    arch_string = json.dumps(jsonable_encoder(model))
-    arch_record = store_new_architecture(db, arch_string)
+def share_architecture(model: ArchitectureDataModel, request: Request):
+    db = get_db(request)
+    # types not known to the loaded schemas may pass the parsing, shared architectures must be exportable
+    layers_schemas = layers_schemas_cache.get(db)
+    unknown_types = sorted({l.type.value for l in model.layers if l.type.value not in layers_schemas.schemas})
+    if unknown_types:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            "Unknown layer types: {}".format(", ".join(unknown_types)))
 
-    return arch_record.id
+    return store_architecture(db, jsonable_encoder(model))
 
 
 @router.get("/load")
-def load_arch(arch_id: int, db: Session = Depends(get_db)):
-    return json.loads(get_architecture_by_id(db, arch_id).data)
+def load_arch(request: Request, arch_id: int):
+    """
+    Returns the architecture as it was stored - shared architectures never change, so it can be cached forever.
+    """
+    loaded = loaded_architectures_cache.get(arch_id)
+    if loaded is None:
+        data = get_architecture_data(get_db(request), arch_id)
+        if data is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, "Architecture not found.")
+
+        loaded = loaded_architecture(data)
+        loaded_architectures_cache.put(arch_id, loaded)
+
+    body, etag = loaded
+    headers = {'ETag': etag, 'Cache-Control': 'public, max-age=31536000, immutable'}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(content=body, media_type='application/json', headers=headers)
@@ -4,6 +4,9 @@ from fastapi.security import OAuth2PasswordBearer
 from starlette.requests import Request
 from starlette.templating import Jinja2Templates
 
+from configs import SessionLocal
+from DAL.pool_metrics import pool_metrics
+
 SECRET_KEY = os.environ['JWT_SECRET_KEY']
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
@@ -11,5 +14,50 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")  # what is `tokenUrl` fo
 templates = Jinja2Templates(directory="nnio-admin/dist")
 
 
+class DbSessionsStats:
+    # only updated by `db_session_middleware`, i.e. always from the event loop thread
+    def __init__(self):
+        self.created = 0
+        self.avoided = 0
+
+    def stats(self):
+        return dict(created=self.created, avoided=self.avoided)
+
+
+db_sessions_stats = DbSessionsStats()
+
+
 def get_db(request: Request):
-    return request.state.db
+    # the session is opened on the first use only, requests that never touch the DB don't get one at all;
+    # called at the point of use - as `Depends(get_db)` it would run before the body is even validated
+    db = getattr(request.state, 'db', None)
+    if db is None:
+        db = request.state.db = SessionLocal()
+        # the session is used right away anyway, its connection is checked out here to measure the wait for it
+        with pool_metrics.checkout_wait():
+            db.connection()
+
+    return db
+
+
+def close_db(request: Request):
+    db = getattr(request.state, 'db', None)
+    if db is None:
+        db_sessions_stats.avoided += 1
+        return
+
+    db_sessions_stats.created += 1
+    db.close()
+
+
+def etag_matches(request: Request, etag: str):
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag == etag or (tag.startswith('W/') and tag[2:] == etag):
+            return True
+
+    return False
@@ -1,6 +1,7 @@
 import json
 import logging
 import os
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -13,6 +14,9 @@ from jwt import PyJWTError
 from pydantic import BaseModel
 import starlette.status as status
 
+from BLL.caching import TTLCache
+from BLL.password_hashing import password_hashing
+from configs import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
 from DAL import schemas, users_repository, db_models
 from routers.common import SECRET_KEY, ALGORITHM, oauth2_scheme, ACCESS_TOKEN_EXPIRE_MINUTES, templates, get_db
 
@@ -28,14 +32,19 @@ class TokenData(BaseModel):
     username: str = None
 
 
-def authenticate_user(db: Session, email: str, password: str):
+async def authenticate_user(db: Session, email: str, password: str):
     user: db_models.User = users_repository.get_user_by_email(db, email)
     if not user:
         return False
 
-    if user.hashed_password != password:
+    if not await password_hashing.verify(user.hashed_password, password):
         return False
 
+    if db.is_modified(user):
+        # rehashed with the currently configured cost
+        db.commit()
+        invalidate_cached_user(user.email)
+
     return user
 
 
@@ -52,34 +61,57 @@ def create_access_token(*, data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
-async def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+# verified token -> its payload, kept no longer than the token is valid
+verified_tokens_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+# email -> user, invalidated whenever the user is changed
+users_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+def invalidate_cached_user(email: str):
+    users_cache.invalidate(email)
+
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)) -> schemas.User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    payload = verified_tokens_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except PyJWTError as e:
+            logging.info("JWT TOKEN LOGIN FAILED: " + str(e))
             raise credentials_exception
 
-        token_data = TokenData(username=username)
-    except PyJWTError as e:
-        logging.info("JWT TOKEN LOGIN FAILED: " + str(e))
-        raise credentials_exception
+        expires_at = None
+        if 'exp' in payload:
+            # `exp` is a wall clock timestamp, the cache works with the monotonic clock
+            expires_at = time.monotonic() + (payload['exp'] - time.time())
+        verified_tokens_cache.put(token, payload, expires_at)
 
-    user = users_repository.get_user_by_email(db, token_data.username)
+    username: str = payload.get("sub")
+    if username is None:
+        raise credentials_exception
 
+    user = users_cache.get(username)
     if user is None:
-        raise credentials_exception
+        # the DB session is opened only when the user isn't cached
+        db_user = users_repository.get_user_by_email(get_db(request), username)
+        if db_user is None:
+            raise credentials_exception
+
+        user = schemas.User.from_orm(db_user)
+        users_cache.put(username, user)
 
     return user
 
 
 @router.post("/login", response_model=Token)
-async def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    db = get_db(request)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -95,9 +127,9 @@ async def login_for_access_token(db: Session = Depends(get_db), form_data: OAuth
 
 
 @router.post("/test_token", response_model=str)
-async def test_token(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def test_token(request: Request, token: str = Depends(oauth2_scheme)):
     try:
-        user = await get_current_user(db, token)
+        user = await get_current_user(request, token)
     except HTTPException:
         logging.info("JWT TOKEN INVALID")
         raise
@@ -116,9 +148,14 @@ def get_admin_page(request: Request):
 
 
 @router.post("/create", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, request: Request):
+    db = get_db(request)
     db_user = users_repository.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
 
-    return users_repository.create_user(db=db, user=user)
+    hashed_password = await password_hashing.hash(user.password)
+    db_user = users_repository.create_user(db=db, user=user, hashed_password=hashed_password)
+    invalidate_cached_user(db_user.email)
+
+    return db_user
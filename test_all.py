@@ -1,11 +1,15 @@
 import json
+import uuid
 from io import StringIO
 from http import HTTPStatus
 
 from starlette.testclient import TestClient
 
 from .main import app
+from configs import init_db
 
+# importing the app doesn't create the tables, `python manage.py init-db` does
+init_db()
 client = TestClient(app)
 
 valid_model_body = json.load(open('example_sequential.json'))
@@ -139,3 +143,668 @@ def test_export_from_json_file_incorrect_data():
     response = client.request('post', '/architecture/export-from-json-file?framework=keras', files=files)
 
     assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_layer_validators_registry_collect_all():
+    from .BLL.validation import LayerValidatorsRegistry
+
+    schema = {
+        "type": "object",
+        "properties": {"params": {
+            "type": "object",
+            "properties": {"units": {"type": "integer"}, "activation": {"type": "string"}},
+        }},
+    }
+    validators = LayerValidatorsRegistry()
+    validators.load({"Dense": schema})
+    layer = dict(name="Dense_1", type="Dense", inputs=[], params=dict(units="many", activation=1))
+
+    assert len(validators.validate_layer("Dense_1", "Dense", layer)) == 1
+    errors = validators.validate_layer("Dense_1", "Dense", layer, collect_all=True)
+    assert sorted(e.path for e in errors) == ["$.params.activation", "$.params.units"]
+    assert all(e.layer_name == "Dense_1" for e in errors)
+    assert validators.validate_layer("Conv_1", "Conv2D", layer, collect_all=True)[0].path == "$.type"
+
+
+def test_layers_schemas_not_modified():
+    response = client.request('get', '/admin/layers_schemas')
+    assert response.status_code == HTTPStatus.OK
+    etag = response.headers['ETag']
+
+    response = client.request('get', '/admin/layers_schemas', headers={'If-None-Match': etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+
+def test_export_cache_hit():
+    url = '/architecture/export-from-json-body?framework=keras&indent=spaces_8'
+    auth = {'Authorization': 'Bearer token'}
+    hits = client.request('get', '/admin/metrics', headers=auth).json()['export_cache']['hits']
+
+    first = client.request('post', url, json=valid_model_body_2_inputs)
+    second = client.request('post', url, json=dict(valid_model_body_2_inputs, id='other_id'))
+
+    assert first.status_code == second.status_code == HTTPStatus.OK
+    assert first.text == second.text
+    assert client.request('get', '/admin/metrics', headers=auth).json()['export_cache']['hits'] == hits + 1
+
+
+def test_architecture_hash_ignores_layers_order():
+    from .BLL.exporting.export_cache import architecture_hash
+    from .models import ArchitectureDataModel
+
+    model = ArchitectureDataModel(**valid_model_body_2_inputs)
+    shuffled = ArchitectureDataModel(**dict(valid_model_body_2_inputs, layers=valid_model_body_2_inputs['layers'][::-1]))
+    renamed = ArchitectureDataModel(**dict(valid_model_body_2_inputs, name='OtherModel'))
+
+    assert architecture_hash(model) == architecture_hash(shuffled)
+    assert architecture_hash(model) != architecture_hash(renamed)
+
+
+def test_export_batch_from_jsonl_file():
+    lines = [json.dumps(valid_model_body), '{"a": "b"}', '', json.dumps(valid_model_body_2_inputs), 'not json']
+    files = {"architectures-file": StringIO('\n'.join(lines))}
+    response = client.request('post', '/architecture/export-batch-from-jsonl-file?framework=keras', files=files)
+
+    assert response.status_code == HTTPStatus.OK
+    results = [json.loads(l) for l in response.text.splitlines()]
+    assert [r['index'] for r in results] == [0, 1, 2, 3]
+    assert [r['error'] is None for r in results] == [True, False, True, False]
+    assert results[0]['source'] and results[0]['id'] == valid_model_body['id']
+
+
+def test_export_from_json_file_cyclic_reports_cycle():
+    files = {"architecture-file": open("example_sequential_small_cyclical.json", 'rt')}
+    response = client.request('post', '/architecture/export-from-json-file?framework=keras', files=files)
+
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.json()['detail'] == "Architecture contains a cycle: name3 -> name2 -> name3."
+
+
+def test_export_from_json_body_diamond_layers_generated_once():
+    layers = [
+        dict(name="x", type="Input", inputs=[], params=dict(shape=[4])),
+        dict(name="y", type="Dense", inputs=["x"], params=dict(units=2)),
+        dict(name="d", type="Dense", inputs=["y"], params=dict(units=2)),
+        dict(name="c", type="Concatenate", inputs=["d", "y"], params={}),
+    ]
+    data = dict(date_created="2019-07-24 17:56:34", id="my_id_1", layers=layers, name='Diamond')
+    response = client.request('post', '/architecture/export-from-json-body?framework=keras', json=data)
+
+    assert response.status_code == HTTPStatus.OK
+    assert [l for l in response.text.splitlines() if ' = ' in l][:4] == [
+        'input_0 = Input(shape=[4], name="x")',
+        'dense_0 = Dense(units=2, name="y")(input_0)',
+        'dense_1 = Dense(units=2, name="d")(dense_0)',
+        'concatenate_0 = Concatenate(name="c")([dense_1, dense_0])',
+    ]
+    assert response.text.count('name="c"') == 1
+
+
+def test_export_from_patch_same_as_full_export():
+    from BLL.exporting.export_cache import export_cache
+
+    layers = [
+        dict(name="x", type="Input", inputs=[], params=dict(shape=[4])),
+        dict(name="y", type="Dense", inputs=["x"], params=dict(units=2)),
+        dict(name="d", type="Dense", inputs=["y"], params=dict(units=2)),
+        dict(name="c", type="Concatenate", inputs=["d", "y"], params={}),
+    ]
+    data = dict(date_created="2019-07-24 17:56:34", id="my_id_1", layers=layers, name='Patched')
+    url = '/architecture/export-from-json-body?framework=keras'
+    base_hash = client.request('post', url, json=data).headers['X-Architecture-Hash']
+
+    patches = [
+        # modified params only, the linked graph of the base is reused
+        [dict(op="modify", name="d", layer=dict(name="d", type="Dense", inputs=["y"], params=dict(units=3)))],
+        [dict(op="add", layer=dict(name="e", type="Dense", inputs=["c"], params=dict(units=1))),
+         dict(op="modify", name="c", layer=dict(name="c2", type="Concatenate", inputs=["d", "y", "x"], params={})),
+         dict(op="modify", name="e", layer=dict(name="e", type="Dense", inputs=["c2"], params=dict(units=1)))],
+        [dict(op="remove", name="e")],
+    ]
+    for operations in patches:
+        patch = dict(base_hash=base_hash, operations=operations)
+        response = client.request('post', '/architecture/export-from-patch?framework=keras', json=patch)
+        assert response.status_code == HTTPStatus.OK, response.text
+
+        positions = {l['name']: i for i, l in enumerate(layers)}
+        for operation in operations:
+            if operation['op'] == 'add':
+                layers.append(operation['layer'])
+                positions[operation['layer']['name']] = len(layers) - 1
+            elif operation['op'] == 'remove':
+                layers.pop(positions[operation['name']])
+            else:
+                layers[positions[operation['name']]] = operation['layer']
+        # the patch export has just cached its code under the same key
+        export_cache.clear()
+        expected = client.request('post', url, json=dict(data, layers=layers))
+
+        assert response.text == expected.text
+        assert response.headers['X-Architecture-Hash'] == expected.headers['X-Architecture-Hash']
+        base_hash = response.headers['X-Architecture-Hash']
+
+    invalid_patch = dict(base_hash=base_hash, operations=[dict(op="remove", name="e")])
+    response = client.request('post', '/architecture/export-from-patch?framework=keras', json=invalid_patch)
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    unknown_base = dict(base_hash="0" * 64, operations=[])
+    response = client.request('post', '/architecture/export-from-patch?framework=keras', json=unknown_base)
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_parse_architecture_same_as_pydantic():
+    from pydantic import ValidationError
+    from BLL.layers_schemas import layers_schemas_cache
+    from configs import SessionLocal
+    from .models import ArchitectureDataModel, parse_architecture
+
+    for body in (valid_model_body, valid_model_body_2_inputs, dict(valid_model_body_small, id=1)):
+        model = parse_architecture(json.loads(json.dumps(body)))
+        assert model.dict() == ArchitectureDataModel(**body).dict()
+
+    invalid_body = dict(valid_model_body_small, layers=[dict(name="x", type="NoSuchLayer", inputs=[], params={})])
+    # checked against the DB just now - surely unknown, rejected while parsing
+    db = SessionLocal()
+    try:
+        layers_schemas_cache.get(db)
+    finally:
+        db.close()
+    try:
+        parse_architecture(invalid_body)
+        assert False, "unknown layer type accepted"
+    except ValidationError as e:
+        assert 'unknown layer type "NoSuchLayer"' in str(e)
+
+    # a stale snapshot leaves it to the endpoints, which check the current schemas
+    invalid_body['layers'] = [dict(name="x", type="Input", inputs=[], params=dict(shape=[3])),
+                              dict(name="y", type="NoSuchLayer", inputs=["x"], params={})]
+    layers_schemas_cache._last_refresh = 0.0
+    response = client.request('post', '/architecture/export-from-json-body?framework=keras', json=invalid_body)
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.json()['detail'].endswith('Unknown layer type "NoSuchLayer"')
+    layers_schemas_cache._last_refresh = 0.0
+    response = client.request('post', '/sharing/share', json=invalid_body)
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert 'NoSuchLayer' in response.text
+
+
+def test_graph_analysis_shared_and_model_intact():
+    from .BLL.exporting.graph_analysis import GraphAnalysis
+    from .BLL.exporting.keras_generators import KerasFunctionalGenerator
+    from .BLL.exporting.python_code_generator import PythonCodeGenerator
+    from .models import ArchitectureDataModel, NetworkModel
+
+    layers = [
+        dict(name="a", type="Dense", inputs=[], params=dict(units=2, input_shape=[4])),
+        dict(name="b", type="Dense", inputs=["a"], params=dict(units=2, kernel_regularizer=dict(l1=0.1))),
+        dict(name="c", type="Dense", inputs=["a"], params=dict(units=2)),
+        dict(name="d", type="Concatenate", inputs=["b", "c"], params={}),
+    ]
+    data = dict(date_created="2019-07-24 17:56:34", id="my_id_1", layers=layers, name='NoInputs')
+    model = NetworkModel.from_data_model(ArchitectureDataModel(**data))
+    analysis = GraphAnalysis(model)
+
+    names = lambda ids: [model.layers[i].name for i in ids]
+    assert not analysis.is_sequential and not analysis.input_layers
+    assert names(analysis.first_layers) == ["a"] and names(analysis.output_layers) == ["d"]
+    assert list(analysis.layer_types) == ["Dense", "Concatenate"] and analysis.num_regularized_layers == 1
+    assert [names(group) for group in analysis.topological_order()] == [["a", "c", "b", "d"]]
+
+    before = [(l.id, l.name, l.type, dict(l.params)) for l in model.layers], list(model.inputs_ids)
+    code = KerasFunctionalGenerator(model, PythonCodeGenerator(), analysis=analysis).generate_code()
+    assert 'Input(shape=[4], name="a_input")' in code and "from keras.regularizers import l1_l2" in code
+    assert ([(l.id, l.name, l.type, l.params) for l in model.layers], list(model.inputs_ids)) == before
+
+
+def test_export_archive():
+    import zipfile
+    from io import BytesIO
+
+    targets = [dict(framework="keras"), dict(framework="keras", keras_prefer_sequential=True, line_break="crlf"),
+               dict(framework="keras", indent="tabs", filename="model.py")]
+    response = client.request('post', '/architecture/export-archive',
+                              json=dict(architecture=valid_model_body_2_inputs, targets=targets))
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['Content-Type'] == 'application/zip'
+
+    archive = zipfile.ZipFile(BytesIO(response.content))
+    assert archive.namelist() == ['keras_lf_spaces_4.py', 'keras_crlf_spaces_4_sequential.py', 'model.py']
+    for target, filename in zip(targets, archive.namelist()):
+        query = '&'.join(f'{k}={str(v).lower()}' for k, v in target.items() if k != 'filename')
+        expected = client.request('post', '/architecture/export-from-json-body?' + query,
+                                  json=valid_model_body_2_inputs)
+        assert archive.read(filename).decode() == expected.text
+
+    duplicate_targets = [dict(framework="keras"), dict(framework="keras")]
+    response = client.request('post', '/architecture/export-archive',
+                              json=dict(architecture=valid_model_body_2_inputs, targets=duplicate_targets))
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_estimate():
+    response = client.request('post', '/architecture/estimate', json=valid_model_body_2_inputs)
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['complete'] and response.json()['params'] > 0
+
+    layers = [
+        dict(name="x", type="Input", inputs=[], params=dict(shape=[224, 224, 3])),
+        dict(name="f", type="Flatten", inputs=["x"], params={}),
+        dict(name="d", type="Dense", inputs=["f"], params=dict(units=1000)),
+    ]
+    data = dict(date_created="2019-07-24 17:56:34", id="my_id_1", layers=layers, name='Large')
+    estimate = client.request('post', '/architecture/estimate', json=data).json()
+    assert [l['output_shape'] for l in estimate['layers']] == [[224, 224, 3], [150528], [1000]]
+    assert estimate['params'] == 150528 * 1000 + 1000 and estimate['flops'] == 2 * 150528 * 1000
+
+    response = client.request('post', '/architecture/export-from-json-body?framework=keras&estimate_header=1',
+                              json=data)
+    assert response.text.startswith("# Estimated per sample, float32 values:\n# parameters: 150,529,000 ")
+
+
+def test_estimate_layers():
+    from .BLL.exporting.shape_inference import estimate_layer, NotEstimated
+    from .models import LayerNode, LayerTypes
+
+    def estimate(layer_type, input_shapes, **params):
+        return estimate_layer(LayerNode(0, "l", LayerTypes(layer_type), params), input_shapes)
+
+    # same as Keras reports
+    assert estimate("Conv2D", [(32, 32, 3)], filters=16, kernel_size=3) == ((30, 30, 16), 448, 2 * 432 * 900)
+    assert estimate("Conv2D", [(32, 32, 3)], filters=16, kernel_size="(3, 3)", strides=2, padding="same")[0] == \
+        (16, 16, 16)
+    assert estimate("MaxPooling2D", [(30, 30, 16)])[0] == (15, 15, 16)
+    assert estimate("Concatenate", [(None, 4), (None, 6)])[0] == (None, 10)
+    assert estimate("Dense", [(None, 10)], units=5) == ((None, 5), 55, None)
+    assert estimate("Reshape", [(6, 4)], target_shape=[-1, 2])[0] == (12, 2)
+    for layer_type, input_shapes in [("Conv2D", [(30, 3)]), ("UnknownLayer", [(3,)])]:
+        try:
+            estimate(layer_type, input_shapes, filters=1, kernel_size=3)
+            assert False, layer_type
+        except NotEstimated:
+            pass
+
+
+def test_wrap_literal():
+    from .BLL.exporting.python_code_generator import PythonCodeGenerator
+
+    assert PythonCodeGenerator.wrap_literal("relu") == '"relu"'
+    assert PythonCodeGenerator.wrap_literal("(224, 224, 3)") == "(224, 224, 3)"
+    assert PythonCodeGenerator.wrap_literal([224, 224, 3]) == "[224, 224, 3]"
+    assert PythonCodeGenerator.wrap_literal([True]) == "[True]" and PythonCodeGenerator.wrap_literal([1]) == "[1]"
+    assert PythonCodeGenerator.wrap_literal(float('nan')) == '"nan"'
+    assert PythonCodeGenerator.wrap_literal({"l1": 0.1}) == "{'l1': 0.1}"
+    assert PythonCodeGenerator.wrap_literal("__import__('os')") == '"__import__(\'os\')"'
+    for values in ([-0.0, 0.0], [0.0, -0.0]):
+        assert [PythonCodeGenerator.wrap_literal(v) for v in values] == [str(v) for v in values]
+        assert [PythonCodeGenerator.wrap_literal([v]) for v in values] == [str([v]) for v in values]
+
+
+def test_export_from_json_body_stream():
+    url = '/architecture/export-from-json-body?framework=keras&line_break=crlf'
+    response = client.request('post', url + '&stream=1', json=valid_model_body_small)
+    expected = client.request('post', url, json=valid_model_body_small)
+
+    assert response.status_code == expected.status_code == HTTPStatus.OK
+    assert response.text == expected.text
+
+
+def test_stream_producers_bounded():
+    # the very instance the app uses (the app imports its modules absolutely)
+    import time
+    from BLL.exporting.code_writer import stream_producers, iter_chunks, StreamProducers, ExportCancelled
+
+    url = '/architecture/export-from-json-body?framework=keras&stream=1&indent=tabs'
+    size = stream_producers.size
+    stream_producers.size = 0
+    try:
+        response = client.request('post', url, json=valid_model_body_small)
+        assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    finally:
+        stream_producers.size = size
+
+    # a writer whose consumer stopped taking chunks gives up, and so does the consumer once the chunks run out
+    producers = StreamProducers(1, stall_timeout=0.2)
+    chunks = iter_chunks(lambda sink: [sink.write(str(i)) for i in range(100)], max_chunks=1, producers=producers)
+    assert next(chunks) == "0"
+    time.sleep(0.5)
+    try:
+        list(chunks)
+        assert False, "abandoned stream completed"
+    except ExportCancelled:
+        pass
+    deadline = time.monotonic() + 5
+    while producers.stats()['running'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert producers.stats()['running'] == 0
+
+
+def test_export_stream_large_model_linked_off_event_loop(monkeypatch):
+    import threading
+    # the very modules the app uses (the app imports its modules absolutely)
+    import routers.architecture_exporting as architecture_exporting
+    from BLL.exporting.export_cache import export_cache
+    from BLL.exporting.export_pool import export_pool
+
+    link_threads = []
+    link_architecture = architecture_exporting.link_architecture
+
+    def recording_link_architecture(*args, **kwargs):
+        link_threads.append(threading.current_thread())
+        return link_architecture(*args, **kwargs)
+
+    monkeypatch.setattr(architecture_exporting, 'link_architecture', recording_link_architecture)
+    # at the threshold
+    monkeypatch.setattr(export_pool, 'min_layers', len(valid_model_body['layers']))
+    export_cache.clear()
+
+    url = '/architecture/export-from-json-body?framework=keras&indent=spaces_8'
+    response = client.request('post', url + '&stream=1', json=valid_model_body)
+    assert response.status_code == HTTPStatus.OK
+    assert link_threads and threading.main_thread() not in link_threads
+
+    export_cache.clear()
+    assert response.text == client.request('post', url, json=valid_model_body).text
+
+    # errors found off the event loop are still reported before anything is streamed
+    monkeypatch.setattr(export_pool, 'min_layers', 1)
+    link_threads.clear()
+    invalid_body = dict(valid_model_body, layers=[l for l in valid_model_body['layers'] if l['type'] != 'Input'])
+    response = client.request('post', url + '&stream=1', json=invalid_body)
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert link_threads and threading.main_thread() not in link_threads
+
+
+def test_python_code_generator_sink():
+    from .BLL.exporting.python_code_generator import PythonCodeGenerator
+
+    sink = StringIO()
+    with PythonCodeGenerator(sink=sink, chunk_size=8) as cg:
+        for i in range(10):
+            cg.add_line(cg.call('Dense', units=i))
+        assert len(sink.getvalue()) > 0
+        assert cg.code == ""
+
+    assert sink.getvalue() == "".join(f"Dense(units={i})\n" for i in range(10))
+
+
+def test_db_session_created_lazily():
+    auth = {'Authorization': 'Bearer token'}
+    before = client.request('get', '/admin/metrics', headers=auth).json()['db_sessions']
+
+    client.request('get', '/admin/layers_schemas')
+    after = client.request('get', '/admin/metrics', headers=auth).json()['db_sessions']
+
+    # the first metrics request never opens a session, the layers schemas one does
+    assert after['avoided'] == before['avoided'] + 1
+    assert after['created'] == before['created'] + 1
+
+    # rejected while parsing the body, before the endpoint could need the DB
+    response = client.request('post', '/architecture/export-from-json-body?framework=keras', json={})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    rejected = client.request('get', '/admin/metrics', headers=auth).json()['db_sessions']
+    assert rejected['created'] == after['created']
+    assert rejected['avoided'] == after['avoided'] + 2
+
+
+def test_db_pool_metrics():
+    auth = {'Authorization': 'Bearer token'}
+    before = client.request('get', '/admin/metrics', headers=auth).json()['db_pool']
+
+    client.request('get', '/admin/layers_schemas')
+    after = client.request('get', '/admin/metrics', headers=auth).json()['db_pool']
+
+    assert after['checkouts'] > before['checkouts']
+    assert after['checkins'] - after['checkouts'] == before['checkins'] - before['checkouts']
+    assert after['checkedout'] == 0
+    assert after['wait_time_total_ms'] > before['wait_time_total_ms']
+
+    # a recreated pool is still measured
+    from configs import engine
+    engine.dispose()
+    client.request('get', '/admin/layers_schemas')
+    disposed = client.request('get', '/admin/metrics', headers=auth).json()['db_pool']
+    assert disposed['connects'] > after['connects'] and disposed['checkouts'] > after['checkouts']
+    assert disposed['wait_time_total_ms'] > after['wait_time_total_ms']
+
+
+def test_export_in_export_pool():
+    # the very instance the app uses (the app imports its modules absolutely)
+    from BLL.exporting.export_pool import export_pool
+
+    url = '/architecture/export-from-json-body?framework=keras&indent=tabs'
+    expected = client.request('post', url, json=valid_model_body_2_inputs)
+
+    min_layers, size = export_pool.min_layers, export_pool.size
+    export_pool.min_layers, export_pool.size = 1, 1
+    try:
+        submitted = export_pool.stats()['submitted']
+        response = client.request('post', url + '&line_break=crlf', json=valid_model_body_2_inputs)
+        cyclic = client.request('post', url, json=json.load(open('example_sequential_small_cyclical.json')))
+        assert export_pool.stats()['submitted'] == submitted + 2
+    finally:
+        export_pool.min_layers, export_pool.size = min_layers, size
+        export_pool.shutdown()
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.text == expected.text.replace('\n', '\r\n')
+    assert cyclic.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert cyclic.json()['detail'] == "Architecture contains a cycle: name3 -> name2 -> name3."
+
+
+def test_share_architecture_deduplicated():
+    first = client.request('post', '/sharing/share', json=valid_model_body_2_inputs)
+    second = client.request('post', '/sharing/share', json=valid_model_body_2_inputs)
+    other = client.request('post', '/sharing/share', json=dict(valid_model_body_2_inputs, name='OtherModel'))
+    # the same content with another id and date
+    resent = client.request('post', '/sharing/share',
+                            json=dict(valid_model_body_2_inputs, id='other_id', date_created="2020-01-01 00:00:00"))
+
+    assert first.status_code == HTTPStatus.OK
+    assert first.json() == second.json() == resent.json() != other.json()
+
+    loaded = client.request('get', '/sharing/load', params={'arch_id': first.json()})
+    assert loaded.json()['layers'] == valid_model_body_2_inputs['layers']
+
+
+def test_content_hash_column_added_to_existing_table(tmp_path):
+    from sqlalchemy import create_engine, inspect
+    from .DAL.architecture_repository import add_content_hash_column
+
+    engine = create_engine('sqlite:///' + str(tmp_path / 'old.db'))
+    # the table as it was before deduplication
+    engine.execute('CREATE TABLE architectures (id INTEGER PRIMARY KEY, data VARCHAR)')
+
+    assert add_content_hash_column(engine)
+    assert 'content_hash' in [c['name'] for c in inspect(engine).get_columns('architectures')]
+    assert not add_content_hash_column(engine)
+
+
+def test_architecture_data_encoding():
+    from .DAL.architecture_repository import encode_architecture_data, decode_architecture_data
+
+    plain = json.dumps(valid_model_body_2_inputs)
+    encoded = encode_architecture_data(plain)
+
+    assert encoded.startswith('z:') and len(encoded) < len(plain)
+    assert decode_architecture_data(encoded) == plain
+    # rows stored before compression are loaded as they are
+    assert decode_architecture_data(plain) == plain
+
+
+def test_load_architecture_cacheable():
+    arch_id = client.request('post', '/sharing/share', json=valid_model_body_small).json()
+
+    response = client.request('get', '/sharing/load', params={'arch_id': arch_id})
+    assert response.status_code == HTTPStatus.OK
+    assert 'immutable' in response.headers['Cache-Control']
+    assert response.json()['layers'] == valid_model_body_small['layers']
+
+    auth = {'Authorization': 'Bearer token'}
+    before = client.request('get', '/admin/metrics', headers=auth).json()['db_sessions']
+    etag = response.headers['ETag']
+    response = client.request('get', '/sharing/load', params={'arch_id': arch_id}, headers={'If-None-Match': etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    # served from the cache without a DB session
+    after = client.request('get', '/admin/metrics', headers=auth).json()['db_sessions']
+    assert after['created'] == before['created']
+
+    response = client.request('get', '/sharing/load', params={'arch_id': 10 ** 9})
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_current_user_cached():
+    auth = {'Authorization': 'Bearer token'}
+    email = 'user-{}@example.com'.format(uuid.uuid4().hex)
+    response = client.request('post', '/user/create', json={'email': email, 'password': 'password'})
+    assert response.status_code == HTTPStatus.OK
+
+    response = client.request('post', '/user/login', data={'username': email, 'password': 'password'})
+    token_auth = {'Authorization': 'Bearer ' + response.json()['access_token']}
+
+    before = client.request('get', '/admin/metrics', headers=auth).json()
+    for _ in range(3):
+        response = client.request('post', '/user/test_token', headers=token_auth)
+        assert response.json() == email
+    after = client.request('get', '/admin/metrics', headers=auth).json()
+
+    assert after['verified_tokens_cache']['hits'] == before['verified_tokens_cache']['hits'] + 2
+    assert after['users_cache']['hits'] == before['users_cache']['hits'] + 2
+    assert after['db_sessions']['avoided'] == before['db_sessions']['avoided'] + 3
+
+    response = client.request('post', '/user/test_token', headers={'Authorization': 'Bearer invalid'})
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_ttl_cache_expiration():
+    import time
+    from .BLL.caching import TTLCache
+
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2, expires_at=time.monotonic() - 1)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert 'b' not in cache
+    assert cache.stats()['expirations'] == 1
+
+
+def test_login_rehashes_password():
+    # the very modules the app uses (the app imports its modules absolutely)
+    from passlib.context import CryptContext
+    from sqlalchemy_utils.types.password import Password
+    from configs import SessionLocal, PASSWORD_HASH_ROUNDS
+    from DAL import users_repository, schemas
+
+    auth = {'Authorization': 'Bearer token'}
+    email = 'user-{}@example.com'.format(uuid.uuid4().hex)
+    cheap_hash = CryptContext(schemes=['pbkdf2_sha512']).hash('password', rounds=1000)
+    db = SessionLocal()
+    try:
+        users_repository.create_user(db, schemas.UserCreate(email=email, password='password'), Password(cheap_hash))
+    finally:
+        db.close()
+
+    before = client.request('get', '/admin/metrics', headers=auth).json()['password_hashing']
+    wrong = client.request('post', '/user/login', data={'username': email, 'password': 'wrong'})
+    response = client.request('post', '/user/login', data={'username': email, 'password': 'password'})
+    after = client.request('get', '/admin/metrics', headers=auth).json()['password_hashing']
+
+    assert wrong.status_code == HTTPStatus.UNAUTHORIZED
+    assert response.status_code == HTTPStatus.OK
+    assert after['verified'] == before['verified'] + 2
+    assert after['rehashed'] == before['rehashed'] + 1
+    assert after['time_total_ms'] > before['time_total_ms']
+
+    db = SessionLocal()
+    try:
+        user = users_repository.get_user_by_email(db, email)
+        assert user.hashed_password.hash.decode() != cheap_hash
+        assert '${}$'.format(PASSWORD_HASH_ROUNDS) in user.hashed_password.hash.decode()
+        assert user.hashed_password == 'password'
+    finally:
+        db.close()
+
+
+def test_layers_schemas_snapshot_file(tmp_path):
+    from BLL.layers_schemas import LayersSchemasCache
+    from configs import SessionLocal
+
+    path = str(tmp_path / 'layers_schemas_snapshot.json')
+    cache = LayersSchemasCache()
+    db = SessionLocal()
+    try:
+        cache.write_snapshot_file(path, db)
+        expected = cache.get(db)
+    finally:
+        db.close()
+
+    loaded = LayersSchemasCache()
+    assert loaded.load_snapshot_file(path)
+    assert not loaded.is_unknown_layer_type('Dense')
+    assert loaded._snapshot.version == expected.version
+    assert loaded._snapshot.etag == expected.etag
+    assert not LayersSchemasCache().load_snapshot_file(str(tmp_path / 'missing.json'))
+
+    # corrupt files are ignored, the schemas are loaded from the DB on the first `get`
+    for corrupt in (b"abc\n{}", b"1", b"1\n{", b"1\n[]", b'1\n{"Dense": {"type": 5}}', b"1\n\xff"):
+        with open(path, 'wb') as f:
+            f.write(corrupt)
+        cache = LayersSchemasCache()
+        assert not cache.load_snapshot_file(path), corrupt
+        db = SessionLocal()
+        try:
+            assert cache.get(db).version == expected.version
+        finally:
+            db.close()
+
+
+def test_benchmark_generators_exportable():
+    from .benchmarks import generators
+
+    url = '/architecture/export-from-json-body?framework=keras'
+    for architecture in [generators.chain(5), generators.fan_out_fan_in(3, 2), generators.resnet(2),
+                         generators.inception(2, shuffle_seed=0), generators.random_dag(50, shuffle_seed=0)]:
+        response = client.request('post', url, json=architecture)
+        assert response.status_code == HTTPStatus.OK, response.text
+
+
+def test_export_server_timing():
+    url = '/architecture/export-from-json-body?framework=keras&line_break=crlf&indent=spaces_2'
+    response = client.request('post', url, json=valid_model_body)
+    assert response.status_code == HTTPStatus.OK
+
+    stages = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+    assert stages[:3] == ['parse', 'schemas', 'cache']
+    assert {'validate', 'link', 'acyclic', 'codegen', 'total'} <= set(stages)
+
+    metrics = client.request('get', '/admin/metrics/prometheus', headers={'Authorization': 'Bearer token'})
+    assert 'nnio_export_stage_duration_seconds_count{stage="codegen",framework="keras",layers="1-10"}' \
+           in metrics.text
+
+
+def test_traffic_capture_and_replay(tmp_path):
+    import asyncio
+    from .BLL.traffic_capture import TrafficCaptureMiddleware, sanitize_query
+    from .benchmarks.replay import InProcessClient, load_records, replay, report
+
+    path = str(tmp_path / 'traffic.jsonl')
+    middleware = TrafficCaptureMiddleware(app, path)
+    capturing_client = TestClient(middleware)
+    capturing_client.request('post', '/architecture/export-from-json-body?framework=keras&access_token=secret',
+                             json=dict(valid_model_body_small, password='secret'))
+    capturing_client.request('get', '/admin/metrics', headers={'Authorization': 'Bearer token'})
+    # written by the writer thread
+    middleware.flush()
+
+    records = load_records(path)
+    assert len(records) == 1
+    assert records[0]['query'] == 'framework=keras'
+    assert records[0]['json']['password'] == '***'
+    assert 'secret' not in open(path).read()
+    assert sanitize_query(b'%74oken=abc&pass%77ord=x&framework=keras&indent=') == 'framework=keras&indent='
+
+    elapsed, results = asyncio.get_event_loop().run_until_complete(
+        replay(InProcessClient(app), records * 4, concurrency=2, rate=0))
+    summary = report(elapsed, results)['endpoints']['POST /architecture/export-from-json-body']
+    assert summary['requests'] == 4
+    assert summary['statuses'] == {'200': 4}